@@ -0,0 +1,46 @@
+import glob
+import os
+from xmlrpc.client import Fault, ServerProxy
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Removes the per-module collector programs of older releases"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dir",
+            type=str,
+            default=settings.SUPERVISOR_COLLECTOR_DIR,
+            help="Supervisor include directory",
+        )
+        parser.add_argument(
+            "--supervisor-url",
+            type=str,
+            default=settings.SUPERVISOR_XMLRPC_URL,
+            help="Supervisor XML-RPC URL, stops the removed programs when set",
+        )
+
+    def handle(self, *args, **options):
+        # 旧版本为每个模块写一个 collector_<模块编号>.conf，现在由run_collector统一采集
+        files = glob.glob(os.path.join(options["dir"], "collector_*.conf"))
+        for file in files:
+            os.remove(file)
+            self.stdout.write(f"removed {file}")
+
+        if not files or not options["supervisor_url"]:
+            return
+
+        # 相当于 supervisorctl update，只处理被删除的进程组
+        rpc = ServerProxy(options["supervisor_url"])
+        added, changed, removed = rpc.supervisor.reloadConfig()[0]
+        for name in removed:
+            try:
+                rpc.supervisor.stopProcessGroup(name)
+                rpc.supervisor.removeProcessGroup(name)
+            except Fault as e:
+                self.stderr.write(f"{name}: {e.faultString}")
+                continue
+            self.stdout.write(f"stopped {name}")
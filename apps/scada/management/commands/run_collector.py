@@ -0,0 +1,249 @@
+import signal
+import socket
+import sys
+import threading
+from datetime import timedelta
+from wsgiref.simple_server import make_server
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+from prometheus_client.exposition import ThreadingWSGIServer
+
+from apps.scada.models import Collector, CollectorNode, Variable
+from apps.scada.script.collector import CollectorHandler, CollectorHost, parse_tiers
+from apps.scada.utils.grm.client import configure_chunk_executor
+from apps.scada.utils.grm.lease import CacheSidLease
+from apps.scada.utils.grm.transport import configure_transport
+from apps.scada.utils.hashring import HashRing
+from apps.scada.utils.remote_write import RemoteWriter
+
+
+class Command(BaseCommand):
+    help = "Runs the collectors assigned to this node by consistent hashing"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--host",
+            type=str,
+            default=settings.SUPERVISOR_COLLECTOR_HOST,
+            help="Host address",
+        )
+        parser.add_argument(
+            "--port",
+            type=int,
+            default=settings.SUPERVISOR_COLLECTOR_PORT,
+            help="Base port, the process index is added to it",
+        )
+        parser.add_argument(
+            "--advertise",
+            type=str,
+            default=settings.SUPERVISOR_COLLECTOR_ADVERTISE,
+            help="Address registered for Prometheus and the API",
+        )
+        parser.add_argument(
+            "--name",
+            type=str,
+            default="",
+            help="Registered node name, defaults to <hostname>_collector_<shard>",
+        )
+        parser.add_argument(
+            "--shard",
+            type=int,
+            default=0,
+            help="Process index on this host, used for the port and default name",
+        )
+        parser.add_argument(
+            "--reload",
+            type=int,
+            default=30,
+            help="Seconds between reloading the module list",
+        )
+        parser.add_argument(
+            "--pool-size",
+            type=int,
+            default=64,
+            help="GRM HTTP connection pool size",
+        )
+        parser.add_argument(
+            "--retries",
+            type=int,
+            default=settings.GRM_HTTP_RETRIES,
+            help="GRM HTTP retries",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Variables per read request, 0 reads all at once",
+        )
+        parser.add_argument(
+            "--read-workers",
+            type=int,
+            default=16,
+            help="Threads shared by all modules for reading extra chunks",
+        )
+        parser.add_argument(
+            "--tiers",
+            type=parse_tiers,
+            default="1",
+            help="Read every N cycles for priority 0,1,2, e.g. 1,3,12",
+        )
+        parser.add_argument(
+            "--enum-interval",
+            type=int,
+            default=300,
+            help="Seconds between variable enumerations",
+        )
+        parser.add_argument(
+            "--ring-seconds",
+            type=int,
+            default=settings.COLLECTOR_RING_SECONDS,
+            help="Seconds of recent values kept in memory for /values",
+        )
+        parser.add_argument(
+            "--max-silence",
+            type=int,
+            default=60,
+            help="Re-emit change-only values unchanged for this many seconds",
+        )
+        parser.add_argument(
+            "--remote-write-url",
+            type=str,
+            default=settings.COLLECTOR_REMOTE_WRITE_URL,
+            help="Push samples to this Prometheus remote-write endpoint",
+        )
+
+    def register(self, name: str, address: str) -> CollectorNode:
+        """注册采集进程并更新心跳"""
+
+        node, _ = CollectorNode.objects.update_or_create(
+            name=name,
+            defaults={"address": address, "heartbeat_at": timezone.now()},
+        )
+        return node
+
+    def load_ring(self) -> HashRing:
+        """所有在线采集进程组成的哈希环"""
+
+        deadline = timezone.now() - timedelta(seconds=settings.COLLECTOR_HEARTBEAT_TTL)
+        names = CollectorNode.objects.filter(heartbeat_at__gte=deadline).values_list(
+            "name", flat=True
+        )
+        return HashRing(list(names))
+
+    def load_modules(self, node: CollectorNode) -> tuple[list[tuple], dict]:
+        """加载按模块编号哈希到当前进程的模块，以及只在变化时推送的变量
+
+        采集进程加入或者离开后，各进程下次同步时按新的哈希环接管或者释放模块
+        """
+
+        ring = self.load_ring()
+        collectors = [
+            c
+            for c in Collector.objects.filter(enabled=True).select_related("module")
+            if ring.get(c.module.module_number) == node.name
+        ]
+
+        # 记录模块由当前进程采集，服务发现和状态查询直接按node查询
+        Collector.objects.filter(id__in=[c.id for c in collectors]).exclude(
+            node=node
+        ).update(node=node)
+        modules = [
+            (
+                c.module.module_number,
+                c.module.module_secret,
+                c.module.module_url,
+                c.interval,
+                c.timeout,
+            )
+            for c in collectors
+        ]
+
+        emissions: dict[str, dict[str, float]] = {}
+        variables = Variable.objects.filter(
+            module_id__in=[c.module_id for c in collectors], change_only=True
+        ).values_list("module__module_number", "name", "deadband")
+        for number, name, deadband in variables:
+            emissions.setdefault(number, {})[name] = max(deadband, 0.0)
+        return modules, emissions
+
+    def handle(self, *args, **options):
+        shard = options["shard"]
+        host = options["host"]
+        port = options["port"] + shard
+        name = options["name"] or f"{socket.gethostname()}_collector_{shard}"
+        address = f"{options['advertise']}:{port}"
+
+        def sync():
+            # 长时间运行的进程需要自己清理失效的数据库连接
+            close_old_connections()
+            node = self.register(name, address)
+            collector_host.update(*self.load_modules(node))
+
+        # 所有模块共享一个HTTP连接池
+        configure_transport(
+            pool_size=options["pool_size"],
+            retries=options["retries"],
+            connect_timeout=settings.GRM_HTTP_CONNECT_TIMEOUT,
+        )
+        # 分批读取时第一批在模块自己的线程读取，其余批次共用这个线程池
+        configure_chunk_executor(options["read_workers"])
+        # 推送模式所有模块共享一个推送队列
+        writer = None
+        if options["remote_write_url"]:
+            writer = RemoteWriter(options["remote_write_url"])
+            writer.start()
+
+        collector_host = CollectorHost(
+            enum_interval=options["enum_interval"],
+            chunk_size=options["chunk_size"],
+            tiers=options["tiers"],
+            # 和API进程共享SID
+            lease=CacheSidLease(cache),
+            writer=writer,
+            ring_seconds=options["ring_seconds"],
+            max_silence=options["max_silence"],
+        )
+
+        # 先监听端口再注册，注册后地址马上可以访问
+        # 多线程处理请求，多个Prometheus同时抓取时不会排队
+        httpd = make_server(
+            host,
+            port,
+            collector_host,
+            server_class=ThreadingWSGIServer,
+            handler_class=CollectorHandler,
+        )
+        t = threading.Thread(target=httpd.serve_forever)
+        t.daemon = True
+        t.start()
+        self.stdout.write(f"# LISTEN {host}:{port}, node {name}")
+
+        sync()
+
+        # 处理停止信号
+        stopped = threading.Event()
+
+        def signal_handler(signal, frame):
+            stopped.set()
+
+        signal.signal(signal.SIGTERM, signal_handler)
+        signal.signal(signal.SIGINT, signal_handler)
+
+        # 定时心跳并同步模块列表
+        while not stopped.wait(options["reload"]):
+            try:
+                sync()
+            except Exception as e:
+                self.stderr.write(f"加载采集模块错误 {e}")
+
+        # 注销后模块的node为空，服务发现马上不再返回
+        CollectorNode.objects.filter(name=name).delete()
+        collector_host.stop()
+        if writer:
+            writer.stop()
+        httpd.shutdown()
+        sys.exit(0)
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-16 22:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scada', '0007_graph_order'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collector',
+            name='enabled',
+            field=models.BooleanField(default=True),
+        ),
+    ]
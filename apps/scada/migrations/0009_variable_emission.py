@@ -0,0 +1,23 @@
+# Generated by Django 4.2.6 on 2026-10-16 22:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("scada", "0008_collector_enabled"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="variable",
+            name="change_only",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="variable",
+            name="deadband",
+            field=models.FloatField(default=0.0),
+        ),
+    ]
@@ -57,6 +57,10 @@ class Variable(models.Model):
     local = models.BooleanField(default=False)
     # 变量自定义描述
     details = models.CharField(default="", max_length=255)
+    # 只在变化时推送
+    change_only = models.BooleanField(default=False)
+    # 变化死区，变化量超过死区才算变化
+    deadband = models.FloatField(default=0.0)
     # 所属模块
     module = models.ForeignKey(Module, on_delete=models.PROTECT)
 
@@ -157,6 +161,19 @@ class Graph(models.Model):
         return self.name
 
 
+class CollectorNode(models.Model):
+    """采集进程注册信息"""
+
+    # 进程名称
+    name = models.CharField(max_length=64, unique=True)
+    # 服务地址 host:port
+    address = models.CharField(max_length=128)
+    # 启动时间
+    started_at = models.DateTimeField(auto_now_add=True)
+    # 最近心跳时间
+    heartbeat_at = models.DateTimeField(db_index=True)
+
+
 class Collector(models.Model):
     """采集器模型"""
 
@@ -166,6 +183,12 @@ class Collector(models.Model):
     interval = models.IntegerField(default=5)
     # 请求超时
     timeout = models.IntegerField(default=3)
+    # 是否启用采集
+    enabled = models.BooleanField(default=True)
+    # 负责采集的进程
+    node = models.ForeignKey(
+        CollectorNode, null=True, blank=True, on_delete=models.SET_NULL
+    )
 
 
 STATIC_METHOD = (
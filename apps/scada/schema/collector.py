@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from ninja import Schema
 
 
@@ -11,10 +13,14 @@ class CollectorOut(Schema):
     interval: int = 5
     # 超时（秒）
     timeout: int = 3
+    # 是否启用
+    enabled: bool = True
     # 运行状态
     running: bool = False
     # 运行地址
     exporter_url: str = ""
+    # 负责采集的进程
+    node_name: str = ""
 
 
 class CollectorIn(Schema):
@@ -31,3 +37,20 @@ class CollectorStatusIn(Schema):
 
     # 运行状态
     running: bool = False
+
+
+class CollectorNodeOut(Schema):
+    """采集进程结构"""
+
+    # 进程名称
+    name: str
+    # 服务地址
+    address: str
+    # 启动时间
+    started_at: datetime
+    # 最近心跳时间
+    heartbeat_at: datetime
+    # 是否在线
+    alive: bool = False
+    # 采集的模块数量
+    modules: int = 0
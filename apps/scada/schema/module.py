@@ -67,3 +67,5 @@ class ModuleInfoOut(ModuleOut):
 
     # 巨控模块信息
     info: GrmModuleInfo = None
+    # 连接熔断状态 closed/open/half_open
+    breaker: str = "closed"
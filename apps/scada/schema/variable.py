@@ -15,7 +15,11 @@ class VariableBase(Schema):
     # 是否本地
     local: bool = False
     # 自定义描述
-    details: str = ''
+    details: str = ""
+    # 只在变化时推送
+    change_only: bool = False
+    # 变化死区
+    deadband: float = 0.0
 
 
 class VariableOut(VariableBase):
@@ -65,6 +69,19 @@ class VariableUpdateIn(Schema):
     rw: bool = False
     # 自定义描述
     details: str
+    # 只在变化时推送，为空时不修改
+    change_only: bool = None
+    # 变化死区，为空时不修改
+    deadband: float = None
+
+
+class VariableEmissionIn(Schema):
+    """变量组推送配置"""
+
+    # 只在变化时推送
+    change_only: bool = False
+    # 变化死区
+    deadband: float = 0.0
 
 
 class ReadValueIn(Schema):
@@ -73,6 +90,22 @@ class ReadValueIn(Schema):
     variable_ids: list[int] = []
 
 
+class ReadRangeIn(Schema):
+    """批量读取历史值请求"""
+
+    variable_ids: list[int] = []
+    # 结束时间，为空时为当前时间
+    offset: int = None
+    # 时长，例如 15m、1h、7d
+    duration: str = "1h"
+    # 时间点间隔（秒）
+    step: int = 15
+    # 每个变量最多返回的点数，为空时不限制
+    max_points: int = None
+    # 超过max_points时的降采样方法 lttb/minmax/step
+    downsample: str = "lttb"
+
+
 class ReadValueOut(Schema):
     """变量值结构体"""
 
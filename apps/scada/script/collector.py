@@ -1,16 +1,33 @@
+import gzip
+import json
 import logging
-import random
+import math
 import signal
 import sys
 import threading
+import time
+from array import array
+from collections import deque
+from urllib.parse import parse_qs
 from wsgiref.simple_server import WSGIRequestHandler, make_server
 
 import click
-from prometheus_client import CollectorRegistry, make_wsgi_app, start_wsgi_server
-from prometheus_client.core import GaugeMetricFamily
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    make_wsgi_app,
+)
+from prometheus_client.exposition import CONTENT_TYPE_LATEST, ThreadingWSGIServer
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 
+from apps.scada.utils.grm.breaker import CircuitBreaker
 from apps.scada.utils.grm.client import GrmClient, GrmError
-
+from apps.scada.utils.grm.snapshot import GrmSnapshot
+from apps.scada.utils.grm.transport import configure_transport, get_transport
+from apps.scada.utils.remote_write import RemoteWriter
 
 # 配置标准输出到日志
 logger = logging.getLogger(__name__)
@@ -20,50 +37,722 @@ server_handler = logging.StreamHandler(stream=sys.stderr)
 server_handler.setLevel(logging.ERROR)
 logger.addHandler(server_handler)
 
+
 class InfoFilter(logging.Filter):
     def filter(self, record):
         return record.levelno == logging.INFO  # 仅允许 INFO 级别的记录通过
-    
+
+
 info_handler = logging.StreamHandler(stream=sys.stdout)
 info_handler.setLevel(logging.INFO)
 info_handler.addFilter(InfoFilter())
 logger.addHandler(info_handler)
 
 
+breaker_states = {
+    CircuitBreaker.CLOSED: 0,
+    CircuitBreaker.HALF_OPEN: 1,
+    CircuitBreaker.OPEN: 2,
+}
+
+
+class GrmCollectorMetrics(object):
+    """采集器自身的指标，带module标签和模块数据一起输出"""
+
+    def __init__(self, module_number):
+        self._module_number = module_number
+
+        # 不注册到全局registry，由GrmCollector输出
+        self.request_seconds = Histogram(
+            "grm_collector_request_seconds",
+            "GRM请求耗时，op为E/R/W/I，登录为L",
+            ["module", "op"],
+            registry=None,
+            buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+        )
+        self.transfer_bytes = Counter(
+            "grm_collector_transfer_bytes",
+            "GRM请求传输字节数",
+            ["module", "direction"],
+            registry=None,
+        )
+        self.logons = Counter(
+            "grm_collector_logons", "GRM登录次数", ["module"], registry=None
+        )
+        self.poll_errors = Counter(
+            "grm_collector_poll_errors", "采集失败次数", ["module"], registry=None
+        )
+        self.read_variables = Counter(
+            "grm_collector_read_variables",
+            "读取的变量数量",
+            ["module"],
+            registry=None,
+        )
+        self.error_variables = Gauge(
+            "grm_collector_error_variables",
+            "上次读取出错的变量数量",
+            ["module"],
+            registry=None,
+        )
+        self.variables = Gauge(
+            "grm_collector_variables", "模块变量数量", ["module"], registry=None
+        )
+        self.changed_variables = Gauge(
+            "grm_collector_changed_variables",
+            "上次读取产生新值的变量数量",
+            ["module"],
+            registry=None,
+        )
+
+        # 预先创建计数，没有发生时也输出0
+        self.logons.labels(module_number)
+        self.poll_errors.labels(module_number)
+
+    def observe(self, op: str, seconds: float, sent: int, received: int):
+        """GrmClient的请求统计回调"""
+
+        self.request_seconds.labels(self._module_number, op).observe(seconds)
+        self.transfer_bytes.labels(self._module_number, "sent").inc(sent)
+        self.transfer_bytes.labels(self._module_number, "received").inc(received)
+        if op == "L":
+            self.logons.labels(self._module_number).inc()
+
+    def collect(self):
+        for metric in (
+            self.request_seconds,
+            self.transfer_bytes,
+            self.logons,
+            self.poll_errors,
+            self.read_variables,
+            self.error_variables,
+            self.variables,
+            self.changed_variables,
+        ):
+            yield from metric.collect()
+
+
 class GrmCollector(object):
-    def __init__(self, module_number, module_secret, module_url):
-        self._client = GrmClient(module_number, module_secret, module_url)
+    def __init__(
+        self,
+        module_number,
+        module_secret,
+        module_url,
+        interval=5,
+        timeout=3,
+        enum_interval=300,
+        chunk_size=0,
+        tiers=(1,),
+        lease=None,
+        emission: dict[str, float] = None,
+        writer: RemoteWriter = None,
+        ring_seconds=300,
+        on_poll=None,
+        max_silence=60,
+    ):
+        self._metrics = GrmCollectorMetrics(module_number)
+        self._client = GrmClient(
+            module_number,
+            module_secret,
+            module_url,
+            timeout=timeout,
+            chunk_size=chunk_size,
+            lease=lease,
+            observer=self._metrics.observe,
+        )
+        self._module_number = module_number
         self._module_url = module_url
+        # 变量列表很少变化，缓存枚举结果
+        self._enum_interval = enum_interval
+        self._enum_retry = min(enum_interval, 60)
+        self._enum_at = 0.0
+        self._vars: GrmSnapshot = None
+        # 读取出错的变量名，重新枚举后保留，只有新出现的错误才触发重新枚举
+        self._read_errors: set[str] = set()
+        # 按优先级分层读取，tiers[p]表示优先级p的变量每隔几个周期读取一次
+        self._tiers = tiers
+        self._tier_indices: list[list[int]] = []
+        self._cycle = 0
+        self._read_all = True
+        # 只在变化时推送的变量，变量名 -> 死区
+        self._emission = emission or {}
+        self._emission_dirty = True
+        # 按下标保存的死区和上次推送的值，死区小于0表示每次都推送
+        self._deadbands = array("d")
+        self._emitted = array("d")
+        self._emitted_at = array("d")
+        self._emitted_names: list[str] = []
+        # 值在死区内时最长多少秒重新推送一次，要小于Prometheus的5分钟回溯时间，
+        # 否则不变的值会被当作过期
+        self._max_silence = max_silence
+        # 推送模式，变化的值带读取时间通过remote-write推送，不再通过/metrics输出
+        self._writer = writer
+        self._series_labels: list[tuple] = []
+        # 后台轮询，采集接口只返回内存中的最新快照
+        self._interval = interval
+        self._snapshot: tuple[float, GrmSnapshot] = None
+        # 最近ring_seconds秒的快照，快照之间共享枚举信息，只占用值和错误码数组
+        self._ring: deque[tuple[float, GrmSnapshot]] = deque(
+            maxlen=max(math.ceil(ring_seconds / interval), 1)
+        )
+        self._stopped = threading.Event()
+        self._thread: threading.Thread = None
+        # 每次轮询结束后的回调，用于刷新缓存的指标
+        self._on_poll = on_poll
+
+    def _get_variables(self) -> GrmSnapshot:
+        """获取缓存的变量列表，过期后重新枚举"""
+
+        if self._vars is None or time.monotonic() - self._enum_at > self._enum_interval:
+            self._vars = self._client.enumerate_snapshot()
+            self._enum_at = time.monotonic()
+            self._read_errors &= set(self._vars.names)
+
+            # 超出配置的优先级归到最后一层，重新枚举后所有变量都要读一次，
+            # 周期计数不清零，分层读取的节奏不受重新枚举影响
+            last = len(self._tiers) - 1
+            self._tier_indices = [[] for _ in self._tiers]
+            for i, priority in enumerate(self._vars.priorities):
+                self._tier_indices[min(max(priority, 0), last)].append(i)
+            self._read_all = True
+            self._emission_dirty = True
+        return self._vars
+
+    def set_emission(self, emission: dict[str, float]):
+        """更新只在变化时推送的变量配置，下次采集时生效"""
+
+        if emission != self._emission:
+            self._emission = emission
+            self._emission_dirty = True
+
+    def _apply_emission(self, vars: GrmSnapshot):
+        """按变量下标重建死区，保留同名变量上次推送的值"""
+
+        emitted = dict(zip(self._emitted_names, zip(self._emitted, self._emitted_at)))
+        self._deadbands = array(
+            "d", [self._emission.get(name, -1.0) for name in vars.names]
+        )
+        last = [emitted.get(name, (math.nan, 0.0)) for name in vars.names]
+        self._emitted = array("d", [e[0] for e in last])
+        self._emitted_at = array("d", [e[1] for e in last])
+        self._emitted_names = vars.names
+        self._emission_dirty = False
+
+        # 推送时间序列的标签，和拉取模式下的指标一致
+        metric = f"grm_{self._module_number}_gauge"
+        self._series_labels = [
+            (
+                ("__name__", metric),
+                ("local", "false"),
+                ("module", self._module_number),
+                ("name", name),
+                ("type", type),
+            )
+            for name, type in zip(vars.names, vars.types)
+        ]
+
+    def _push(self, vars: GrmSnapshot, read_at: float):
+        """推送本周期变化的值"""
+
+        timestamp = int(read_at * 1000)
+        labels, values = self._series_labels, vars.values
+        self._writer.write(
+            [
+                (labels[i], values[i], timestamp)
+                for i, changed in enumerate(vars.changed)
+                if changed
+            ]
+        )
+
+    def _mark_changed(self, vars: GrmSnapshot, due: list[int], read_at: float) -> int:
+        """标记本周期产生新值的变量，返回变化的数量
+
+        未读取或者读取出错的变量不算变化；只在变化时推送的变量，
+        和上次推送的值相差超过死区才算变化，首次读取总是算变化，
+        超过max_silence秒没有推送时也算变化
+        """
+
+        if self._emission_dirty:
+            self._apply_emission(vars)
+
+        changed = array("b", bytes(len(vars)))
+        values, errors = vars.values, vars.errors
+        deadbands, emitted, emitted_at = (
+            self._deadbands,
+            self._emitted,
+            self._emitted_at,
+        )
+        silent_before = read_at - self._max_silence
+        count = 0
+        for i in due:
+            if errors[i] != 0:
+                continue
+            value, last = values[i], emitted[i]
+            if deadbands[i] >= 0 and not math.isnan(last):
+                if abs(value - last) <= deadbands[i] and emitted_at[i] > silent_before:
+                    continue
+            emitted[i] = value
+            emitted_at[i] = read_at
+            changed[i] = 1
+            count += 1
+        vars.changed = changed
+        return count
+
+    def _get_due_indices(self) -> list[int]:
+        """获取本周期需要读取的变量下标"""
+
+        due: list[int] = []
+        for multiple, indices in zip(self._tiers, self._tier_indices):
+            if self._read_all or self._cycle % multiple == 0:
+                due.extend(indices)
+        self._cycle += 1
+        self._read_all = False
+
+        # 全部到期时按顺序读取，解析时可以整体赋值
+        if len(due) == len(self._vars):
+            return range(len(due))
+        return due
+
+    def invalidate(self):
+        """下次采集时重新枚举变量"""
+
+        self._vars = None
+
+    def poll(self):
+        """读取一次模块数据并更新快照"""
+
         try:
+            # 登录延迟到第一次采集，已有SID时不会重复登录
             self._client.connect()
         except GrmError as e:
             logger.error(f"登陆GRM模块错误 {e.message}")
+            self._metrics.poll_errors.labels(self._module_number).inc()
+            return
 
-    def collect(self):
         try:
             # 获取变量
-            vars = self._client.enumerate()
-            # 获取值
-            self._client.read(vars)
+            vars = self._get_variables()
+            # 获取本周期到期的变量值，其他变量保留上次读取的值
+            due = self._get_due_indices()
+            if due:
+                self._client.read_snapshot(vars, due)
+            read_at = time.time()
         except GrmError as e:
             logger.error(f"读取GRM模块数据错误 {e.message}")
-            raise StopIteration()
+            self._metrics.poll_errors.labels(self._module_number).inc()
+            self.invalidate()
+            return
+
+        # 出现新的读取错误，可能是模块的变量被修改过；一直出错的变量不会重复触发，
+        # 并且两次重新枚举至少间隔enum_retry秒
+        errors, names = vars.errors, vars.names
+        read_errors = [i for i in due if errors[i] != 0]
+        failing = {names[i] for i in read_errors}
+        if failing - self._read_errors and (
+            time.monotonic() - self._enum_at >= self._enum_retry
+        ):
+            self.invalidate()
+        if self._read_errors:
+            failing |= self._read_errors - {names[i] for i in due}
+        self._read_errors = failing
+
+        for i in read_errors:
+            logger.error(f"ERROR: {errors[i]}, Variable: {names[i]}")
+
+        self._metrics.variables.labels(self._module_number).set(len(vars))
+        self._metrics.read_variables.labels(self._module_number).inc(len(due))
+        self._metrics.error_variables.labels(self._module_number).set(len(read_errors))
+        self._metrics.changed_variables.labels(self._module_number).set(
+            self._mark_changed(vars, due, read_at)
+        )
+        if self._writer is not None:
+            self._push(vars, read_at)
+
+        # 复制一份整体替换，读取方不需要加锁
+        self._snapshot = (read_at, vars.copy())
+        self._ring.append(self._snapshot)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            started = time.monotonic()
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"采集GRM模块异常 {e}")
+            if self._on_poll:
+                try:
+                    self._on_poll()
+                except Exception as e:
+                    logger.error(f"刷新指标缓存异常 {e}")
+            # 按固定周期轮询，读取耗时计入周期内
+            self._stopped.wait(max(0, self._interval - (time.monotonic() - started)))
+
+    def start(self):
+        """启动后台轮询线程"""
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """停止后台轮询线程"""
+
+        self._stopped.set()
+
+    def since(self) -> float:
+        """内存中最早的快照时间，没有快照时返回0"""
+
+        ring = self._ring
+        return ring[0][0] if ring else 0.0
+
+    def history(self, names: list[str], seconds=0) -> dict[str, list[list[float]]]:
+        """获取变量最近的值，返回变量名 -> [[时间戳, 值], ...]
+
+        seconds为0时返回最新值，否则返回最近seconds秒内每个快照的值，
+        另外带上窗口开始前的最后一个快照，调用方可以向前填充；
+        快照中保留了分层读取和只在变化时推送的变量上次读取的值，
+        没有读取成功或者数据已经过期的变量不返回
+        """
+
+        snapshot = self._snapshot
+        if snapshot is None or time.time() - snapshot[0] > self._interval * 3:
+            return {}
+
+        if seconds <= 0:
+            snapshot_at, vars = snapshot
+            out = {}
+            for name in names:
+                i = vars.index.get(name)
+                if i is not None and vars.errors[i] == 0:
+                    out[name] = [[snapshot_at, vars.values[i]]]
+            return out
+
+        since = time.time() - seconds
+        ring = list(self._ring)
+        first = 0
+        for k, (snapshot_at, _) in enumerate(ring):
+            if snapshot_at <= since:
+                first = k
+        out = {name: [] for name in names}
+        for snapshot_at, vars in ring[first:]:
+            for name in names:
+                i = vars.index.get(name)
+                if i is not None and vars.errors[i] == 0:
+                    out[name].append([snapshot_at, vars.values[i]])
+        return {name: values for name, values in out.items() if values}
+
+    def collect(self):
+        yield from self._metrics.collect()
+
+        # 熔断状态，0关闭 1半开 2打开
+        breaker = GaugeMetricFamily(
+            "grm_collector_breaker_state", "模块连接熔断状态", labels=["module"]
+        )
+        breaker.add_metric(
+            labels=[self._module_number],
+            value=breaker_states[self._client.breaker.state],
+        )
+        yield breaker
+
+        snapshot = self._snapshot
+        if snapshot is None:
+            return
+
+        snapshot_at, vars = snapshot
+
+        # 快照时间，用于判断数据是否过期
+        t = GaugeMetricFamily(
+            f"grm_{self._module_number}_snapshot_timestamp_seconds",
+            "Grm设备数据快照时间",
+        )
+        t.add_metric(labels=[], value=snapshot_at)
+        yield t
+
+        age = GaugeMetricFamily(
+            "grm_collector_snapshot_age_seconds", "快照距今时间", labels=["module"]
+        )
+        age.add_metric(labels=[self._module_number], value=time.time() - snapshot_at)
+        yield age
+
+        # 长时间没有读取成功，不再输出过期数据；推送模式下数据已经推送
+        if time.time() - snapshot_at > self._interval * 3 or self._writer:
+            return
 
         # 构建指标
         g = GaugeMetricFamily(
-            f"grm_{self._client.token.id}_gauge",
+            f"grm_{self._module_number}_gauge",
             "Grm设备数据",
             labels=["name", "type", "local"],
         )
-        for v in vars:
-            if v.read_error == 0:
+        for name, type, value, error in zip(
+            vars.names, vars.types, vars.values, vars.errors
+        ):
+            if error == 0:
                 # 全部统一用浮点值，客户端使用type解决转换问题
-                g.add_metric(labels=[v.name, v.type, "false"], value=v.value)
-            else:
-                logger.error(f"ERROR: {v.read_error}, Variable: {v.name}")
+                g.add_metric(labels=[name, type, "false"], value=value)
         yield g
 
 
+class GrmTransportCollector(object):
+    """进程内共享连接池的复用情况"""
+
+    def collect(self):
+        stats = get_transport().stats.to_dict()
+
+        yield CounterMetricFamily(
+            "grm_transport_requests", "GRM HTTP请求数量", value=stats["requests"]
+        )
+        yield CounterMetricFamily(
+            "grm_transport_connections",
+            "GRM HTTP新建连接数量",
+            value=stats["connections"],
+        )
+
+
+class CachedMetricsApp(object):
+    """缓存指标文本的WSGI应用
+
+    每次轮询后渲染一次并压缩一份gzip，抓取时直接返回缓存，
+    缓存超过max_age秒没有刷新时（轮询卡住）按请求重新渲染
+    """
+
+    def __init__(self, registry: CollectorRegistry, max_age: float = 15):
+        self._registry = registry
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        # (渲染时间, 原文, gzip压缩)
+        self._cache: tuple[float, bytes, bytes] = None
+
+    def refresh(self):
+        """重新渲染指标"""
+
+        data = generate_latest(self._registry)
+        cache = (time.monotonic(), data, gzip.compress(data, compresslevel=6))
+        with self._lock:
+            self._cache = cache
+
+    def __call__(self, environ, start_response):
+        cache = self._cache
+        if cache is None or time.monotonic() - cache[0] > self._max_age:
+            self.refresh()
+            cache = self._cache
+
+        headers = [("Content-Type", CONTENT_TYPE_LATEST), ("Vary", "Accept-Encoding")]
+        if "gzip" in environ.get("HTTP_ACCEPT_ENCODING", ""):
+            body = cache[2]
+            headers.append(("Content-Encoding", "gzip"))
+        else:
+            body = cache[1]
+        headers.append(("Content-Length", str(len(body))))
+
+        start_response("200 OK", headers)
+        return [body]
+
+
+class RemoteWriteCollector(object):
+    """remote-write推送的情况"""
+
+    def __init__(self, writer: RemoteWriter):
+        self._writer = writer
+
+    def collect(self):
+        samples = CounterMetricFamily(
+            "grm_remote_write_samples", "推送的样本数量", labels=["result"]
+        )
+        for result, value in self._writer.stats.to_dict().items():
+            samples.add_metric(labels=[result], value=value)
+        yield samples
+
+        queue = GaugeMetricFamily(
+            "grm_remote_write_queue_samples", "等待推送的样本数量"
+        )
+        queue.add_metric(labels=[], value=len(self._writer))
+        yield queue
+
+
+class CollectorHost(object):
+    """在一个进程里托管多个模块的采集器
+
+    每个模块使用独立的registry，通过 /metrics/<module_number> 访问，
+    进程自身的指标通过 /metrics 访问，
+    变量最近的值通过 /values/<module_number>?name=xx&seconds=60 访问，
+    变量较多时可以POST {"names": [...], "seconds": 60}；
+    一次读取多个模块POST /values {"modules": {"<module_number>": [...]}, "seconds": 60}
+    """
+
+    def __init__(self, **collector_options):
+        # 传递给每个GrmCollector的参数
+        self._collector_options = collector_options
+        self._lock = threading.Lock()
+        # module_number -> (模块配置, 采集器, wsgi应用)
+        self._apps: dict[str, tuple[tuple, GrmCollector, object]] = {}
+
+        registry = CollectorRegistry()
+        registry.register(GrmTransportCollector())
+        if collector_options.get("writer"):
+            registry.register(RemoteWriteCollector(collector_options["writer"]))
+        self._app = make_wsgi_app(registry)
+
+    def update(
+        self,
+        modules: list[tuple[str, str, str, int, int]],
+        emissions: dict[str, dict[str, float]] = None,
+    ):
+        """同步托管的模块列表
+
+        模块配置为(module_number, module_secret, module_url, interval, timeout)，
+        emissions为每个模块只在变化时推送的变量和死区，修改后不需要重启采集器
+        """
+
+        wanted = {m[0]: m for m in modules}
+        emissions = emissions or {}
+
+        with self._lock:
+            apps = dict(self._apps)
+
+        # 删除不再需要的模块
+        for number in list(apps.keys()):
+            if number not in wanted or apps[number][0] != wanted[number]:
+                apps.pop(number)[1].stop()
+                logger.info(f"# REMOVE {number}")
+
+        # 新增或者配置变化的模块
+        for number, config in wanted.items():
+            if number in apps:
+                apps[number][1].set_emission(emissions.get(number, {}))
+                continue
+
+            registry = CollectorRegistry()
+            app = CachedMetricsApp(registry, max_age=config[3] * 3)
+            collector = GrmCollector(
+                module_number=config[0],
+                module_secret=config[1],
+                module_url=config[2],
+                interval=config[3],
+                timeout=config[4],
+                emission=emissions.get(number, {}),
+                on_poll=app.refresh,
+                **self._collector_options,
+            )
+            registry.register(collector)
+            collector.start()
+
+            apps[number] = (config, collector, app)
+            logger.info(f"# ADD {number}")
+
+        with self._lock:
+            self._apps = apps
+
+    def modules(self) -> list[str]:
+        """托管的模块编号"""
+
+        with self._lock:
+            return list(self._apps.keys())
+
+    def stop(self):
+        """停止所有采集器"""
+
+        with self._lock:
+            for _, collector, _ in self._apps.values():
+                collector.stop()
+
+    def _values(self, number: str, environ, start_response):
+        """返回内存中的变量值，API读取当前值时不需要经过Prometheus"""
+
+        with self._lock:
+            entry = self._apps.get(number)
+        if entry is None:
+            start_response("404 Not Found", [("Content-Type", "text/plain")])
+            return [b"Not Found"]
+
+        query = parse_qs(environ.get("QUERY_STRING", ""))
+        names = query.get("name", [])
+        seconds = int(query.get("seconds", ["0"])[0])
+        if environ.get("REQUEST_METHOD") == "POST":
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+            body = json.loads(environ["wsgi.input"].read(length) or b"{}")
+            names = body.get("names", names)
+            seconds = int(body.get("seconds", seconds))
+
+        # since为内存中最早的快照时间，调用方据此判断是否覆盖了请求的时间范围
+        collector = entry[1]
+        data = json.dumps(
+            {
+                "module": number,
+                "since": collector.since(),
+                "values": collector.history(names, seconds),
+            }
+        ).encode()
+        start_response(
+            "200 OK",
+            [("Content-Type", "application/json"), ("Content-Length", str(len(data)))],
+        )
+        return [data]
+
+    def _batch_values(self, environ, start_response):
+        """一次返回多个模块内存中的变量值，不在本进程的模块不返回"""
+
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+        body = json.loads(environ["wsgi.input"].read(length) or b"{}")
+        seconds = int(body.get("seconds", 0))
+
+        with self._lock:
+            apps = self._apps
+        out = {}
+        for number, names in body.get("modules", {}).items():
+            entry = apps.get(number)
+            if entry:
+                out[number] = {
+                    "since": entry[1].since(),
+                    "values": entry[1].history(names, seconds),
+                }
+
+        data = json.dumps({"modules": out}).encode()
+        start_response(
+            "200 OK",
+            [("Content-Type", "application/json"), ("Content-Length", str(len(data)))],
+        )
+        return [data]
+
+    def __call__(self, environ, start_response):
+        """按路径分发到模块的exporter"""
+
+        path = environ.get("PATH_INFO", "")
+        prefix = "/metrics/"
+
+        if path.rstrip("/") == "/values" and environ.get("REQUEST_METHOD") == "POST":
+            return self._batch_values(environ, start_response)
+
+        if path.startswith("/values/"):
+            return self._values(
+                path[len("/values/") :].strip("/"), environ, start_response
+            )
+
+        app = None
+        if path.rstrip("/") == "/metrics":
+            app = self._app
+        elif path.startswith(prefix):
+            with self._lock:
+                entry = self._apps.get(path[len(prefix) :].strip("/"))
+            if entry:
+                app = entry[2]
+
+        if app is None:
+            start_response("404 Not Found", [("Content-Type", "text/plain")])
+            return [b"Not Found"]
+
+        return app(environ, start_response)
+
+
+def parse_tiers(value: str) -> tuple[int, ...]:
+    """解析优先级分层配置，例如 1,3,12"""
+
+    tiers = tuple(int(t) for t in value.split(",") if t.strip())
+    if not tiers or min(tiers) < 1:
+        raise ValueError(f"invalid tiers: {value}")
+    return tiers
+
+
 class CollectorHandler(WSGIRequestHandler):
     """WSGI handler"""
 
@@ -87,11 +776,11 @@ class CollectorHandler(WSGIRequestHandler):
 
 @click.command()
 @click.option(
-    "--random_port",
-    envvar="RANDOM_PORT",
+    "--port",
+    envvar="PORT",
     type=int,
     required=True,
-    help="Random port start number",
+    help="Listen port",
 )
 @click.option(
     "--host",
@@ -128,41 +817,131 @@ class CollectorHandler(WSGIRequestHandler):
     type=str,
     help="Module URL",
 )
-def cli(random_port, host, advertise, module_number, module_secret, module_url):
+@click.option(
+    "--interval",
+    envvar="INTERVAL",
+    default=5,
+    type=int,
+    help="Seconds between module reads",
+)
+@click.option(
+    "--timeout",
+    envvar="TIMEOUT",
+    default=3,
+    type=int,
+    help="GRM request timeout in seconds",
+)
+@click.option(
+    "--pool-size",
+    envvar="POOL_SIZE",
+    default=10,
+    type=int,
+    help="GRM HTTP connection pool size",
+)
+@click.option(
+    "--retries",
+    envvar="RETRIES",
+    default=1,
+    type=int,
+    help="GRM HTTP retries",
+)
+@click.option(
+    "--chunk-size",
+    envvar="CHUNK_SIZE",
+    default=1000,
+    type=int,
+    help="Variables per read request, 0 reads all at once",
+)
+@click.option(
+    "--tiers",
+    envvar="TIERS",
+    default="1",
+    type=str,
+    help="Read every N cycles for priority 0,1,2, e.g. 1,3,12",
+)
+@click.option(
+    "--enum-interval",
+    envvar="ENUM_INTERVAL",
+    default=300,
+    type=int,
+    help="Seconds between variable enumerations",
+)
+@click.option(
+    "--remote-write-url",
+    envvar="REMOTE_WRITE_URL",
+    default="",
+    type=str,
+    help="Push samples to this Prometheus remote-write endpoint",
+)
+def cli(
+    port,
+    host,
+    advertise,
+    module_number,
+    module_secret,
+    module_url,
+    interval,
+    timeout,
+    pool_size,
+    retries,
+    chunk_size,
+    tiers,
+    enum_interval,
+    remote_write_url,
+):
     """命令入口"""
+    configure_transport(pool_size=pool_size, retries=retries, connect_timeout=timeout)
+    writer = None
+    if remote_write_url:
+        writer = RemoteWriter(remote_write_url)
+        writer.start()
+    registry = CollectorRegistry()
+    app = CachedMetricsApp(registry, max_age=interval * 3)
     collector = GrmCollector(
-        module_number=module_number, module_secret=module_secret, module_url=module_url
+        module_number=module_number,
+        module_secret=module_secret,
+        module_url=module_url,
+        interval=interval,
+        timeout=timeout,
+        enum_interval=enum_interval,
+        chunk_size=chunk_size,
+        tiers=parse_tiers(tiers),
+        writer=writer,
+        on_poll=app.refresh,
     )
-    registry = CollectorRegistry()
     registry.register(collector)
+    registry.register(GrmTransportCollector())
+    if writer:
+        registry.register(RemoteWriteCollector(writer))
+    collector.start()
 
-    start_port = random_port
-    end_port = random_port + 1000
-    for _ in range(0, 3):
-        try:
-            # 随机端口
-            port = random.randint(start_port, end_port)
-            # 构建wsgi服务器
-            app = make_wsgi_app(registry)
-            httpd = make_server(host, port, app, handler_class=CollectorHandler)
-            t = threading.Thread(target=httpd.serve_forever)
-            t.daemon = True
-            t.start()
-            # 写日志，设定一个标记给管理引用获取exporter的访问地址
-            logger.info(f"# ADVERTISE {advertise}:{port}")
-
-            # 处理停止信号
-            def signal_handler(signal, frame):
-                logger.info("Received SIGTERM. Cleaning up...")
-                sys.exit(0)
-
-            # 注册信号处理程序
-            signal.signal(signal.SIGTERM, signal_handler)
-            # 阻塞主线程
-            signal.pause()
-        except OSError as e:
-            logger.error(f"Failed to start server on {host}:{port}: {e}")
-    sys.exit(-1)
+    try:
+        # 使用固定端口，地址由调用方配置，不需要再从日志获取
+        httpd = make_server(
+            host,
+            port,
+            app,
+            server_class=ThreadingWSGIServer,
+            handler_class=CollectorHandler,
+        )
+    except OSError as e:
+        logger.error(f"Failed to start server on {host}:{port}: {e}")
+        sys.exit(-1)
+
+    t = threading.Thread(target=httpd.serve_forever)
+    t.daemon = True
+    t.start()
+    logger.info(f"# ADVERTISE {advertise}:{port}")
+
+    # 处理停止信号
+    def signal_handler(signal, frame):
+        logger.info("Received SIGTERM. Cleaning up...")
+        sys.exit(0)
+
+    # 注册信号处理程序
+    signal.signal(signal.SIGTERM, signal_handler)
+    # 阻塞主线程
+    signal.pause()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,247 @@
+import asyncio
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import requests
+
+from apps.scada.script.collector import CollectorHost
+from apps.scada.utils.grm.aio import AsyncGrmClient, AsyncGrmTransport
+from apps.scada.utils.grm.client import GrmClient, GrmError
+from apps.scada.utils.grm.schemas import GrmVariable
+from apps.scada.utils.grm.snapshot import GrmSnapshot
+from apps.scada.utils.grm.transport import configure_transport
+
+
+def percentile(samples: list[float], p: float) -> float:
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * p), len(samples) - 1)]
+
+
+def simulator_stats(url: str) -> dict[str, int]:
+    return requests.get(f"{url}/stats", timeout=3).json()
+
+
+def connect_modules(
+    url: str, numbers: list[str], secret: str, chunk_size: int, workers: int
+) -> list[tuple[GrmClient, GrmSnapshot]]:
+    """登录并枚举所有模块"""
+
+    def _connect(number):
+        client = GrmClient(number, secret, url, chunk_size=chunk_size)
+        client.connect()
+        return client, client.enumerate_snapshot()
+
+    with ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(_connect, numbers))
+
+
+def run_requests(fn, duration: int, workers: int) -> tuple[list[float], int]:
+    """多个线程循环调用fn，返回每次调用的耗时和失败次数"""
+
+    latencies: list[float] = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def _worker(worker):
+        local: list[float] = []
+        failed = 0
+        n = 0
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                fn(worker, n)
+            except GrmError:
+                failed += 1
+            local.append(time.perf_counter() - started)
+            n += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=_worker, args=(i,)) for i in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors[0]
+
+
+async def run_async_reads(
+    url: str,
+    numbers: list[str],
+    secret: str,
+    chunk_size: int,
+    duration: int,
+    workers: int,
+    limit: int,
+) -> tuple[list[float], int, float, dict[str, int]]:
+    """一个事件循环中workers个协程循环读取所有模块，上游并发不超过limit
+
+    返回每次读取的耗时、失败次数、平均变量数量和连接统计
+    """
+
+    transport = AsyncGrmTransport(limit=limit)
+    clients = [
+        AsyncGrmClient(number, secret, url, chunk_size=chunk_size, transport=transport)
+        for number in numbers
+    ]
+    await asyncio.gather(*[c.connect() for c in clients])
+    snapshots = await asyncio.gather(*[c.enumerate_snapshot() for c in clients])
+
+    latencies: list[float] = []
+    errors = 0
+    deadline = time.monotonic() + duration
+
+    async def _worker(worker):
+        nonlocal errors
+        n = 0
+        while time.monotonic() < deadline:
+            i = (worker + n * workers) % len(clients)
+            started = time.perf_counter()
+            try:
+                await clients[i].read_snapshot(snapshots[i].copy())
+            except GrmError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+            n += 1
+
+    await asyncio.gather(*[_worker(i) for i in range(workers)])
+    await transport.close()
+    variables = sum(len(s) for s in snapshots) / len(snapshots)
+    return latencies, errors, variables, transport.stats.to_dict()
+
+
+def report(name: str, modules: int, latencies: list[float], errors: int, **extra):
+    calls = len(latencies)
+    fields = [
+        f"{name} modules={modules}",
+        f"calls={calls}",
+        f"errors={errors}",
+        f"p50={percentile(latencies, 0.5) * 1000:.1f}ms",
+        f"p95={percentile(latencies, 0.95) * 1000:.1f}ms",
+        f"p99={percentile(latencies, 0.99) * 1000:.1f}ms",
+    ]
+    if latencies:
+        fields.append(f"mean={statistics.fmean(latencies) * 1000:.1f}ms")
+    fields.extend(f"{k}={v}" for k, v in extra.items())
+    click.echo(" ".join(fields))
+
+
+@click.command()
+@click.option("--url", default="http://127.0.0.1:8700", help="Simulator URL")
+@click.option(
+    "--mode",
+    default="read",
+    type=click.Choice(["read", "write", "collector", "aio"]),
+    help="read/write call GrmClient directly, aio reads with AsyncGrmClient, "
+    "collector runs a CollectorHost",
+)
+@click.option("--modules", default="1,100,1000", help="Module counts to run")
+@click.option("--prefix", default="SIM", help="Module number prefix")
+@click.option("--secret", default="secret", help="Module password")
+@click.option("--duration", default=30, type=int, help="Seconds for each run")
+@click.option("--workers", default=32, type=int, help="Concurrent requests")
+@click.option("--pool-size", default=64, type=int, help="HTTP connection pool size")
+@click.option("--chunk-size", default=1000, type=int, help="Variables per read")
+@click.option("--interval", default=5, type=int, help="Collector poll interval")
+def cli(
+    url,
+    mode,
+    modules,
+    prefix,
+    secret,
+    duration,
+    workers,
+    pool_size,
+    chunk_size,
+    interval,
+):
+    """对GRM模拟服务压测，需要先启动 grm_simulator 并且模块数量不少于最大的 --modules"""
+
+    configure_transport(pool_size=pool_size, retries=0, connect_timeout=3)
+
+    for count in [int(m) for m in modules.split(",") if m.strip()]:
+        numbers = [f"{prefix}{i:04d}" for i in range(count)]
+
+        if mode == "collector":
+            # 采集器按固定周期轮询，统计模拟服务端实际收到的请求
+            host = CollectorHost(chunk_size=chunk_size)
+            before = simulator_stats(url)
+            host.update([(n, secret, url, interval, 3) for n in numbers])
+            time.sleep(duration)
+            host.stop()
+            host.update([])
+            after = simulator_stats(url)
+            reads = after["R"] - before["R"]
+            click.echo(
+                f"collector modules={count} "
+                f"reads={reads} reads/s={reads / duration:.1f} "
+                f"expected/s={count / interval:.1f} "
+                f"logons={after['L'] - before['L']} "
+                f"errors={after['injected'] - before['injected']}"
+            )
+            continue
+
+        if mode == "aio":
+            # 单线程事件循环，workers为并发的协程数量，pool_size为上游并发上限
+            latencies, errors, variables, stats = asyncio.run(
+                run_async_reads(
+                    url, numbers, secret, chunk_size, duration, workers, pool_size
+                )
+            )
+            report(
+                "aio",
+                count,
+                latencies,
+                errors,
+                **{"variables/s": int(len(latencies) * variables / duration)},
+                **stats,
+            )
+            continue
+
+        clients = connect_modules(url, numbers, secret, chunk_size, workers)
+
+        if mode == "read":
+
+            def _call(worker, n):
+                client, snapshot = clients[(worker + n * workers) % len(clients)]
+                client.read_snapshot(snapshot.copy())
+
+            latencies, errors = run_requests(_call, duration, workers)
+            variables = sum(len(s) for _, s in clients) / len(clients)
+            report(
+                "read",
+                count,
+                latencies,
+                errors,
+                **{"variables/s": int(len(latencies) * variables / duration)},
+            )
+        else:
+
+            def _call(worker, n):
+                client, snapshot = random.choice(clients)
+                i = random.randrange(len(snapshot))
+                client.write(
+                    [
+                        GrmVariable(
+                            module_number=client.token.id,
+                            name=snapshot.names[i],
+                            type=snapshot.types[i],
+                            value=float(n),
+                        )
+                    ]
+                )
+
+            latencies, errors = run_requests(_call, duration, workers)
+            report("write", count, latencies, errors)
+
+
+if __name__ == "__main__":
+    cli()
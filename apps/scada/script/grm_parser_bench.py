@@ -0,0 +1,111 @@
+import random
+import timeit
+from array import array
+
+import click
+
+from apps.scada.utils.grm.parser import parse_enumerate, parse_read, split_lines
+
+
+def build_payloads(variables: int, error_rate: float) -> tuple[bytes, bytes]:
+    """构建枚举和读取的响应"""
+
+    rows = [f"v{i},F,W,{i % 3},g{i % 10}" for i in range(variables)]
+    enum_body = f"OK\r\n{variables}\r\n" + "\r\n".join(rows)
+
+    values = [
+        (
+            "#ERROR#3"
+            if random.random() < error_rate
+            else f"{random.uniform(-1e3, 1e3):.3f}"
+        )
+        for _ in range(variables)
+    ]
+    read_body = f"OK\r\n{variables}\r\n" + "\r\n".join(values)
+    return enum_body.encode(), read_body.encode()
+
+
+def legacy_enumerate(body: bytes):
+    """原来的实现：解码后拆分，逐行按逗号拆分"""
+
+    lines = body.decode("utf-8").split("\r\n")[1:]
+    n = int(lines[0])
+    names, types, rws, priorities, groups = [], [], array("b"), array("b"), []
+    for row in lines[1 : n + 1]:
+        fields = row.split(",")
+        names.append(fields[0])
+        types.append(fields[1])
+        rws.append(fields[2] == "W")
+        priorities.append(int(fields[3]))
+        groups.append(fields[4])
+    return names, types, rws, priorities, groups
+
+
+def legacy_read(body: bytes, indices, values: array, errors: array):
+    """原来的实现：解码后拆分，逐行判断前缀并转换"""
+
+    lines = body.decode("utf-8").split("\r\n")[1:]
+    n = int(lines[0])
+    for i, row in zip(indices, lines[1 : n + 1]):
+        if row.startswith("#ERROR#"):
+            errors[i] = int(row[7:])
+        else:
+            errors[i] = 0
+            values[i] = float(row)
+
+
+def bench(fn, number: int) -> float:
+    """返回单次调用的毫秒数，取多轮的最小值"""
+
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1000
+
+
+@click.command()
+@click.option("--variables", default=5000, type=int, help="Variables in the payload")
+@click.option("--error-rate", default=0.0, type=float, help="Fraction of #ERROR# rows")
+@click.option("--number", default=200, type=int, help="Calls per round")
+def cli(variables, error_rate, number):
+    """对比GRM响应解析的耗时"""
+
+    enum_body, read_body = build_payloads(variables, error_rate)
+    indices = range(variables)
+    values = array("d", bytes(8 * variables))
+    errors = array("i", bytes(4 * variables))
+
+    # 两种实现的结果必须一致
+    legacy_values, legacy_errors = array("d", values), array("i", errors)
+    legacy_read(read_body, indices, legacy_values, legacy_errors)
+    parse_read(split_lines(read_body)[1:], indices, values, errors)
+    assert values == legacy_values and errors == legacy_errors
+    assert legacy_enumerate(enum_body) == parse_enumerate(split_lines(enum_body)[1:])
+
+    cases = [
+        (
+            "enumerate",
+            lambda: legacy_enumerate(enum_body),
+            lambda: parse_enumerate(split_lines(enum_body)[1:]),
+        ),
+        (
+            "read",
+            lambda: legacy_read(read_body, indices, values, errors),
+            lambda: parse_read(split_lines(read_body)[1:], indices, values, errors),
+        ),
+        (
+            "read-list",
+            lambda: legacy_read(read_body, list(indices), values, errors),
+            lambda: parse_read(
+                split_lines(read_body)[1:], list(indices), values, errors
+            ),
+        ),
+    ]
+    for name, legacy, parser in cases:
+        before = bench(legacy, number)
+        after = bench(parser, number)
+        click.echo(
+            f"{name:10s} variables={variables} legacy={before:.3f}ms "
+            f"parser={after:.3f}ms speedup={before / after:.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,321 @@
+import json
+import logging
+import math
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import click
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.addHandler(logging.StreamHandler(stream=sys.stdout))
+
+# 变量类型按下标循环
+var_types = ("F", "I", "B")
+
+
+class GrmSimulator(object):
+    """巨控模块的本地模拟
+
+    模块编号为 prefix + 序号，例如 SIM0000 ~ SIM0999，所有模块使用同一个密钥；
+    每个模块有variables个变量 v0 ~ v<n-1>，类型按F/I/B循环，
+    读取的值随时间变化，写入的值会保存到下次读取
+    """
+
+    def __init__(
+        self,
+        modules=1,
+        variables=100,
+        prefix="SIM",
+        secret="secret",
+        sid_ttl=600,
+        error_rate=0.0,
+        var_error_rate=0.0,
+    ):
+        self._modules = modules
+        self._variables = variables
+        self._prefix = prefix
+        self._secret = secret
+        self._sid_ttl = sid_ttl
+        self._error_rate = error_rate
+        self._var_error_rate = var_error_rate
+        self._lock = threading.Lock()
+        # sid -> [模块编号, 最后使用时间]
+        self._sids: dict[str, list] = {}
+        # 模块编号 -> {变量下标: 写入的值}
+        self._written: dict[str, dict[int, float]] = {}
+        self._logon_at: dict[str, datetime] = {}
+        self._stats: dict[str, int] = {op: 0 for op in "LEIRW"}
+        self._stats.update(expired=0, injected=0)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._stats, sids=len(self._sids))
+
+    def _incr(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def inject_error(self) -> bool:
+        """按配置的概率返回HTTP错误"""
+
+        if self._error_rate and random.random() < self._error_rate:
+            self._incr("injected")
+            return True
+        return False
+
+    def _index(self, name: str) -> int:
+        """变量名转换为下标，不存在返回-1"""
+
+        if name[:1] != "v" or not name[1:].isdigit():
+            return -1
+        i = int(name[1:])
+        return i if i < self._variables else -1
+
+    def _value(self, module_number: str, i: int, now: float) -> float:
+        written = self._written.get(module_number)
+        if written and i in written:
+            return written[i]
+
+        wave = math.sin(now / 60 + i)
+        t = var_types[i % 3]
+        if t == "B":
+            return float(wave > 0)
+        if t == "I":
+            return float(int(wave * 100))
+        return round(wave * 100, 3)
+
+    def logon(self, lines: list[str], data_url: str) -> str:
+        self._incr("L")
+        fields = dict(line.split("=", 1) for line in lines if "=" in line)
+        number = fields.get("GRM", "")
+
+        index = number[len(self._prefix) :]
+        if (
+            not number.startswith(self._prefix)
+            or not index.isdigit()
+            or int(index) >= self._modules
+        ):
+            return "ERROR\r\n1\r\n模块不存在"
+        if fields.get("PASS") != self._secret:
+            return "ERROR\r\n2\r\n密码错误"
+
+        sid = uuid.uuid4().hex
+        with self._lock:
+            self._sids[sid] = [number, time.monotonic()]
+            self._logon_at[number] = datetime.now()
+        return f"OK\r\nADDR={data_url}\r\nSID={sid}"
+
+    def exdata(self, sid: str, op: str, lines: list[str]) -> str:
+        if op not in ("E", "R", "W", "I"):
+            return "ERROR\r\n4\r\n操作不支持"
+        self._incr(op)
+
+        now = time.monotonic()
+        with self._lock:
+            session = self._sids.get(sid)
+            if session and now - session[1] > self._sid_ttl:
+                del self._sids[sid]
+                self._stats["expired"] += 1
+                session = None
+            if session is None:
+                return "ERROR\r\n8\r\nSID无效"
+            session[1] = now
+        number = session[0]
+
+        if op == "E":
+            rows = [
+                f"v{i},{var_types[i % 3]},{'W' if i % 2 else 'R'},{i % 3},g{i % 10}"
+                for i in range(self._variables)
+            ]
+            return f"OK\r\n{len(rows)}\r\n" + "\r\n".join(rows)
+
+        if op == "R":
+            n = int(lines[0])
+            clock = time.time()
+            rows = []
+            for name in lines[1 : n + 1]:
+                i = self._index(name)
+                if i < 0:
+                    rows.append("#ERROR#3")
+                elif self._var_error_rate and random.random() < self._var_error_rate:
+                    rows.append("#ERROR#5")
+                else:
+                    rows.append(str(self._value(number, i, clock)))
+            return f"OK\r\n{n}\r\n" + "\r\n".join(rows)
+
+        if op == "W":
+            n = int(lines[0])
+            rows = []
+            written = self._written.setdefault(number, {})
+            for k in range(n):
+                i = self._index(lines[1 + k * 2])
+                if i < 0:
+                    rows.append("3")
+                    continue
+                written[i] = float(lines[2 + k * 2])
+                rows.append("0")
+            return f"OK\r\n{n}\r\n" + "\r\n".join(rows)
+
+        format_str = "%Y%m%d%H%M%S%f"
+        logon_at = self._logon_at.get(number, datetime.now()).strftime(format_str)
+        active_at = datetime.now().strftime(format_str)
+        with self._lock:
+            clients = sum(1 for s in self._sids.values() if s[0] == number)
+        return "\r\n".join(
+            [
+                "OK",
+                number,
+                "GRM simulator",
+                "",
+                str(clients),
+                "1",
+                logon_at[:17],
+                active_at[:17],
+                "127.0.0.1",
+            ]
+        )
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    """GRM协议的HTTP接口，/stats返回请求计数"""
+
+    protocol_version = "HTTP/1.1"
+    simulator: GrmSimulator = None
+    data_url = ""
+    latency = 0.0
+    jitter = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: str, content_type="text/plain;charset=utf-8"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._reply(200, json.dumps(self.simulator.stats()), "application/json")
+        else:
+            self._reply(404, "Not Found")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        lines = self.rfile.read(length).decode("utf-8").split("\r\n")
+
+        # 模拟网络和模块的响应时间
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if self.simulator.inject_error():
+            self._reply(500, "Internal Server Error")
+            return
+
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path == "/exlog":
+            body = self.simulator.logon(lines, self.data_url)
+        elif url.path == "/exdata":
+            body = self.simulator.exdata(query.get("SID"), query.get("OP"), lines)
+        else:
+            self._reply(404, "Not Found")
+            return
+        self._reply(200, body)
+
+
+class SimulatorServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        """压测客户端退出时断开的连接不打印异常"""
+
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+@click.command()
+@click.option("--host", envvar="HOST", default="127.0.0.1", help="Listen address")
+@click.option("--port", envvar="PORT", default=8700, type=int, help="Listen port")
+@click.option(
+    "--advertise",
+    envvar="ADVERTISE",
+    default="",
+    help="Data address returned by logon, defaults to host:port",
+)
+@click.option("--modules", default=1, type=int, help="Number of modules")
+@click.option("--variables", default=100, type=int, help="Variables per module")
+@click.option("--prefix", default="SIM", help="Module number prefix")
+@click.option("--secret", default="secret", help="Password of all modules")
+@click.option("--latency", default=0.0, type=float, help="Response delay in ms")
+@click.option("--jitter", default=0.0, type=float, help="Random +/- delay in ms")
+@click.option(
+    "--error-rate", default=0.0, type=float, help="Probability of HTTP 500 responses"
+)
+@click.option(
+    "--var-error-rate",
+    default=0.0,
+    type=float,
+    help="Probability of #ERROR# for each variable read",
+)
+@click.option(
+    "--sid-ttl", default=600, type=int, help="Seconds before an idle SID expires"
+)
+def cli(
+    host,
+    port,
+    advertise,
+    modules,
+    variables,
+    prefix,
+    secret,
+    latency,
+    jitter,
+    error_rate,
+    var_error_rate,
+    sid_ttl,
+):
+    """启动GRM模拟服务"""
+
+    simulator = GrmSimulator(
+        modules=modules,
+        variables=variables,
+        prefix=prefix,
+        secret=secret,
+        sid_ttl=sid_ttl,
+        error_rate=error_rate,
+        var_error_rate=var_error_rate,
+    )
+
+    handler = type(
+        "Handler",
+        (SimulatorHandler,),
+        {
+            "simulator": simulator,
+            "data_url": advertise or f"{host}:{port}",
+            "latency": latency / 1000,
+            "jitter": jitter / 1000,
+        },
+    )
+    httpd = SimulatorServer((host, port), handler)
+    logger.info(
+        f"# LISTEN {host}:{port}, modules {prefix}{0:04d}~{prefix}{modules - 1:04d}"
+    )
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    cli()
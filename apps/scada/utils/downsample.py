@@ -0,0 +1,114 @@
+import math
+
+import numpy as np
+
+# Prometheus单次范围查询最多返回的点数
+MAX_RANGE_POINTS = 11000
+
+# 降采样方法，step只放大查询间隔
+DOWNSAMPLE_METHODS = ("lttb", "minmax", "step")
+
+
+def choose_step(duration: int, step: int, max_points: int, method="lttb") -> int:
+    """根据最大点数选择查询间隔
+
+    lttb和minmax按最大点数的4倍查询，留出挑选的余量，
+    step直接按最大点数放大间隔
+    """
+
+    points = max_points if method == "step" else max_points * 4
+    points = min(points, MAX_RANGE_POINTS)
+    return max(step, math.ceil(duration / points))
+
+
+def to_arrays(values: list) -> tuple[np.ndarray, np.ndarray]:
+    """Prometheus的 [[时间戳, "值"], ...] 转换为时间戳和值两个数组"""
+
+    if not values:
+        return np.empty(0), np.empty(0)
+    matrix = np.array(values, dtype=float)
+    return matrix[:, 0], matrix[:, 1]
+
+
+def lttb(
+    t: np.ndarray, v: np.ndarray, max_points: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Largest-Triangle-Three-Buckets降采样
+
+    保留首尾两个点，中间分成max_points-2个桶，每个桶选和上一个选中点、
+    下一个桶平均点组成的三角形面积最大的点，保留曲线的形状
+    """
+
+    n = len(t)
+    if max_points >= n or max_points < 3:
+        return t, v
+
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int)
+    selected = np.empty(max_points, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    a = 0
+    for i in range(max_points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # 下一个桶的平均点，最后一个桶使用终点
+        nlo, nhi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        avg_t = t[nlo:nhi].mean()
+        avg_v = v[nlo:nhi].mean()
+
+        area = np.abs(
+            (t[a] - avg_t) * (v[lo:hi] - v[a]) - (t[a] - t[lo:hi]) * (avg_v - v[a])
+        )
+        a = lo + int(np.nanargmax(area)) if not np.isnan(area).all() else lo
+        selected[i + 1] = a
+
+    return t[selected], v[selected]
+
+
+def minmax(
+    t: np.ndarray, v: np.ndarray, max_points: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """按桶保留最小值和最大值，每个桶两个点，适合需要看到尖峰的曲线"""
+
+    n = len(t)
+    buckets = max_points // 2
+    if max_points >= n or buckets < 1:
+        return t, v
+
+    size = math.ceil(n / buckets)
+    buckets = math.ceil(n / size)
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = v
+    padded = padded.reshape(buckets, size)
+
+    # 全部是NaN的桶取第一个点
+    valid = ~np.isnan(padded).all(axis=1)
+    filled = np.where(np.isnan(padded), np.inf, padded)
+    lo = np.where(valid, filled.argmin(axis=1), 0)
+    filled = np.where(np.isnan(padded), -np.inf, padded)
+    hi = np.where(valid, filled.argmax(axis=1), 0)
+
+    # 每个桶内按时间先后排列，同一个点只保留一次
+    offsets = np.arange(buckets) * size
+    pairs = np.sort(np.stack([lo, hi], axis=1), axis=1) + offsets[:, None]
+    keep = np.ones(pairs.shape, dtype=bool)
+    keep[:, 1] = pairs[:, 0] != pairs[:, 1]
+    indices = np.minimum(pairs[keep], n - 1)
+    return t[indices], v[indices]
+
+
+def downsample_series(
+    t: np.ndarray, v: np.ndarray, max_points: int, method="lttb"
+) -> tuple[np.ndarray, np.ndarray]:
+    """超过max_points时按method降采样"""
+
+    if method == "lttb":
+        return lttb(t, v, max_points)
+    if method == "minmax":
+        return minmax(t, v, max_points)
+
+    # step方法已经在查询时放大间隔，这里只截断保证上限
+    if len(t) > max_points:
+        indices = np.linspace(0, len(t) - 1, max_points).astype(int)
+        return t[indices], v[indices]
+    return t, v
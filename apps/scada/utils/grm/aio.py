@@ -0,0 +1,475 @@
+import asyncio
+import ssl
+import time
+import weakref
+from urllib.parse import urlsplit
+
+from requests.utils import get_encoding_from_headers
+
+from apps.scada.utils.grm.breaker import CircuitBreaker, get_breaker
+from apps.scada.utils.grm.client import (
+    GrmClient,
+    GrmError,
+    exdata_url,
+    logon_body,
+    parse_exdata,
+    parse_info,
+    parse_logon,
+    parse_write,
+    read_body,
+    split_chunks,
+    write_body,
+)
+from apps.scada.utils.grm.lease import CacheSidLease
+from apps.scada.utils.grm.parser import parse_enumerate, parse_read, split_lines
+from apps.scada.utils.grm.schemas import GrmModuleInfo, GrmModuleToken, GrmVariable
+from apps.scada.utils.grm.snapshot import GrmSnapshot
+from apps.scada.utils.grm.transport import GrmTransportStats
+
+
+class AsyncGrmResponse:
+    """HTTP响应，编码的判断和requests一致"""
+
+    def __init__(self, status_code: int, headers: dict[str, str], content: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.encoding = get_encoding_from_headers(headers)
+
+
+class _Connection:
+    """一个到上游地址的长连接"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.released_at = 0.0
+
+    @property
+    def usable(self) -> bool:
+        # 空闲期间事件循环仍在读取，服务端关闭连接后reader会收到EOF
+        return not self.reader.at_eof() and not self.writer.is_closing()
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncGrmTransport:
+    """GRM的异步HTTP传输层
+
+    GRM接口是HTTP/1.1的文本POST，直接使用asyncio的流收发，不依赖异步HTTP库；
+    每个上游地址保持空闲的长连接，同时进行的请求不超过limit个，超过的请求排队等待。
+    只能在创建它的事件循环中使用
+    """
+
+    def __init__(self, limit=16, connect_timeout=3, idle_timeout=30) -> None:
+        self._limit = limit
+        self._connect_timeout = connect_timeout
+        # 空闲超过这个时间的连接可能已经被中间设备断开，不再复用
+        self._idle_timeout = idle_timeout
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._idle: dict[str, list[_Connection]] = {}
+        self.stats = GrmTransportStats()
+
+    def _acquire(self, key: str) -> _Connection:
+        """取一个可用的空闲连接，没有则返回None"""
+
+        idle = self._idle.get(key)
+        deadline = time.monotonic() - self._idle_timeout
+        while idle:
+            conn = idle.pop()
+            if conn.usable and conn.released_at >= deadline:
+                return conn
+            conn.close()
+        return None
+
+    def _release(self, key: str, conn: _Connection):
+        conn.released_at = time.monotonic()
+        self._idle.setdefault(key, []).append(conn)
+
+    async def _connect(self, parts, timeout) -> _Connection:
+        https = parts.scheme == "https"
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                parts.hostname,
+                parts.port or (443 if https else 80),
+                ssl=ssl.create_default_context() if https else None,
+            ),
+            min(self._connect_timeout, timeout),
+        )
+        self.stats.incr("connections")
+        return _Connection(reader, writer)
+
+    async def _exchange(
+        self, conn: _Connection, request: bytes
+    ) -> tuple[AsyncGrmResponse, bool]:
+        """发送请求并读取响应，返回响应和连接能否复用"""
+
+        reader = conn.reader
+        conn.writer.write(request)
+        await conn.writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("连接已被服务端关闭")
+        try:
+            version, status = status_line.decode("latin-1").split(None, 2)[:2]
+            status = int(status)
+        except ValueError:
+            raise ConnectionError(f"无效的HTTP响应 {status_line[:64]!r}")
+
+        headers: dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = headers.get("connection", "").lower() != "close" and (
+            version == "HTTP/1.1"
+            or headers.get("connection", "").lower() == "keep-alive"
+        )
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = await self._read_chunked(reader)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            # 没有长度的响应读到连接关闭
+            body = await reader.read()
+            keep_alive = False
+
+        return AsyncGrmResponse(status, headers, body), keep_alive
+
+    async def _read_chunked(self, reader: asyncio.StreamReader) -> bytes:
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+
+        # 跳过trailer
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        return b"".join(chunks)
+
+    async def post(
+        self, url: str, headers: dict, data: bytes, timeout, idempotent=True
+    ) -> AsyncGrmResponse:
+        """发送POST请求，连接和读取错误都抛出OSError，超时为TimeoutError
+
+        复用的空闲连接失败时，幂等的请求换新连接重试一次，
+        读取超时说明请求已经发到模块，不重试
+        """
+
+        parts = urlsplit(url)
+        key = f"{parts.scheme}://{parts.netloc}"
+        target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        head = f"POST {target} HTTP/1.1\r\nHost: {parts.netloc}\r\n"
+        head += "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+        head += f"Content-Length: {len(data)}\r\n\r\n"
+        request = head.encode("latin-1") + data
+
+        self.stats.incr("requests")
+        semaphore = self._semaphores.get(key)
+        if semaphore is None:
+            semaphore = self._semaphores[key] = asyncio.Semaphore(self._limit)
+
+        async with semaphore:
+            conn = self._acquire(key)
+            while True:
+                reused = conn is not None
+                try:
+                    if conn is None:
+                        conn = await self._connect(parts, timeout)
+                    resp, keep_alive = await asyncio.wait_for(
+                        self._exchange(conn, request), timeout
+                    )
+                except asyncio.TimeoutError:
+                    if conn:
+                        conn.close()
+                    raise TimeoutError(f"请求超时 {url}")
+                except (OSError, EOFError, ValueError) as e:
+                    if conn:
+                        conn.close()
+                    if reused and idempotent:
+                        conn = None
+                        continue
+                    if isinstance(e, OSError):
+                        raise
+                    raise ConnectionError(f"读取响应失败 {e}")
+
+                if keep_alive:
+                    self._release(key, conn)
+                else:
+                    conn.close()
+                return resp
+
+    async def close(self):
+        idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+# 事件循环 -> 传输层
+_default_transports = weakref.WeakKeyDictionary()
+
+
+def get_async_transport() -> AsyncGrmTransport:
+    """获取当前事件循环共享的传输层，同一个事件循环的客户端共用连接和并发限制"""
+
+    loop = asyncio.get_running_loop()
+    transport = _default_transports.get(loop)
+    if transport is None:
+        transport = _default_transports[loop] = AsyncGrmTransport()
+    return transport
+
+
+class AsyncGrmClient:
+    """GrmClient的异步版本
+
+    请求体和响应的解析和GrmClient共用，请求通过AsyncGrmTransport发送，
+    一个事件循环可以同时轮询大量模块，同一个上游地址的并发由传输层限制：
+
+        clients = [AsyncGrmClient(number, secret, url) for ...]
+        await asyncio.gather(*[c.read_snapshot(s) for c, s in ...])
+
+    熔断器和GrmClient共享；配置租约时在线程中读写缓存的SID，
+    跨进程的登录锁需要阻塞等待，这里只合并同一个客户端并发的登录
+    """
+
+    req_header = GrmClient.req_header
+
+    def __init__(
+        self,
+        module_id: str,
+        module_secret: str,
+        module_url: str,
+        timeout=5,
+        reconnect=True,
+        transport: AsyncGrmTransport = None,
+        chunk_size=0,
+        lease: CacheSidLease = None,
+        observer=None,
+        breaker: CircuitBreaker = None,
+    ) -> None:
+        self._module_id = module_id
+        self._module_secret = module_secret
+        self._module_url = module_url
+        self._timeout = timeout
+        self._reconnect = reconnect
+        self._module_token: GrmModuleToken = None
+        # 默认使用事件循环共享的传输层
+        self._transport = transport
+        # 变量很多时分批并发读取，0表示不分批
+        self._chunk_size = chunk_size
+        self._logon_lock = asyncio.Lock()
+        self._lease = lease
+        self._sid_ttl = lease.ttl if lease else 540
+        self._used_at = 0.0
+        # 请求统计回调 observer(op, seconds, sent_bytes, received_bytes)，登录的op为L
+        self._observer = observer
+        self._breaker = breaker or get_breaker(
+            module_id, lease.cache if lease else None
+        )
+
+    async def _post(self, url: str, data: str, op: str) -> tuple[list[bytes], str]:
+        """发送请求，返回按行拆分的响应和响应的编码，行不解码"""
+
+        if not self._breaker.allow():
+            raise GrmError(-2, f"模块连接熔断 {self._breaker.state}")
+
+        transport = self._transport or get_async_transport()
+        body = data.encode("utf-8")
+        received = 0
+        started = time.perf_counter()
+        try:
+            resp = await transport.post(
+                url=url,
+                headers=self.req_header,
+                data=body,
+                timeout=self._timeout,
+                idempotent=op != "W",
+            )
+            received = len(resp.content)
+        except OSError as e:
+            self._breaker.failure()
+            raise GrmError(-1, f"HTTP请求错误 {e}")
+        finally:
+            if self._observer:
+                self._observer(op, time.perf_counter() - started, len(body), received)
+
+        if resp.status_code != 200:
+            self._breaker.failure()
+            raise GrmError(resp.status_code, "HTTP连接错误")
+
+        self._breaker.success()
+        return split_lines(resp.content), resp.encoding or "utf-8"
+
+    async def _exdata(self, data: str, op: str) -> tuple[list[bytes], str]:
+        """GRM数据获取接口，返回OK之后的行和响应的编码"""
+
+        token = self._module_token
+        results, encoding = await self._post(exdata_url(token, op), data, op)
+
+        lines = parse_exdata(results, encoding)
+        self._used_at = time.monotonic()
+        if self._lease:
+            self._lease.touch(token)
+        return lines, encoding
+
+    async def _exlogon(self) -> GrmModuleToken:
+        """GRM模块登录"""
+
+        data = logon_body(self._module_id, self._module_secret)
+        url = f"{self._module_url}/exlog"
+
+        lines, encoding = await self._post(url, data, "L")
+        self._module_token = parse_logon(self._module_id, lines, encoding)
+        self._used_at = time.monotonic()
+        return self._module_token
+
+    @property
+    def token(self):
+        return self._module_token
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        return self._breaker
+
+    async def connect(
+        self, token: GrmModuleToken = None, force=False
+    ) -> GrmModuleToken:
+        """连接到模块数据，参考GrmClient.connect"""
+
+        if token and token.id == self._module_id:
+            self._module_token = token
+            return token
+        elif self._module_token and not force:
+            return self._module_token
+        else:
+            return await self._logon(self._module_token if force else None)
+
+    async def _logon(self, failed: GrmModuleToken = None) -> GrmModuleToken:
+        """获取SID，配置了租约时优先使用其他进程登录的SID"""
+
+        if self._lease is None:
+            return await self._exlogon()
+
+        token = await asyncio.to_thread(self._lease.get, self._module_id)
+        if token and (failed is None or token.sid != failed.sid):
+            self._module_token = token
+            self._used_at = time.monotonic()
+            return token
+
+        token = await self._exlogon()
+        await asyncio.to_thread(self._lease.put, token)
+        return token
+
+    def _with_reconnect(fn):
+        """自动重连装饰器，参考GrmClient._with_reconnect"""
+
+        async def wrapper(self, *args, **kwargs):
+            token = self._module_token
+            if (
+                self._reconnect
+                and token
+                and time.monotonic() - self._used_at > self._sid_ttl
+            ):
+                async with self._logon_lock:
+                    if self._module_token is token:
+                        await self._logon()
+                token = self._module_token
+
+            try:
+                return await fn(self, *args, **kwargs)
+            except GrmError as err:
+                if self._reconnect and err.code == 8:
+                    # 并发请求只需要一个刷新SID
+                    async with self._logon_lock:
+                        if self._module_token is token:
+                            await self._logon(token)
+                    return await fn(self, *args, **kwargs)
+                raise err
+
+        return wrapper
+
+    async def enumerate(self) -> list[GrmVariable]:
+        """枚举模块变量"""
+
+        return (await self.enumerate_snapshot()).to_variables()
+
+    @_with_reconnect
+    async def enumerate_snapshot(self) -> GrmSnapshot:
+        """枚举模块变量，返回不含值的快照"""
+
+        lines, encoding = await self._exdata("NTRPG", "E")
+        names, types, rws, priorities, groups = parse_enumerate(lines, encoding)
+
+        return GrmSnapshot(self._module_id, names, types, rws, priorities, groups)
+
+    async def read(self, vars: list[GrmVariable]) -> None:
+        """读取列表中的变量值"""
+
+        snapshot = GrmSnapshot.from_variables(vars)
+        await self.read_snapshot(snapshot)
+
+        for var, value, error in zip(vars, snapshot.values, snapshot.errors):
+            var.read_error = error
+            if error == 0:
+                var.value = value
+
+    async def read_snapshot(
+        self, snapshot: GrmSnapshot, indices: list[int] = None
+    ) -> None:
+        """读取快照中指定下标的变量值，默认读取全部
+
+        变量数量超过chunk_size时分批并发读取，某一批失败只设置该批变量的错误码，
+        全部失败时抛出第一个错误
+        """
+
+        if indices is None:
+            indices = range(len(snapshot))
+
+        chunks = split_chunks(indices, self._chunk_size)
+        if len(chunks) == 1:
+            await self._read(snapshot, indices)
+            return
+
+        results = await asyncio.gather(
+            *[self._read(snapshot, c) for c in chunks], return_exceptions=True
+        )
+
+        errors: list[GrmError] = []
+        for chunk, result in zip(chunks, results):
+            if isinstance(result, GrmError):
+                errors.append(result)
+                for i in chunk:
+                    snapshot.errors[i] = result.code
+            elif isinstance(result, BaseException):
+                raise result
+
+        if len(errors) == len(chunks):
+            raise errors[0]
+
+    @_with_reconnect
+    async def _read(self, snapshot: GrmSnapshot, indices: list[int]) -> None:
+        """读取一批变量的值"""
+
+        lines, _ = await self._exdata(read_body(snapshot.names, indices), "R")
+        parse_read(lines, indices, snapshot.values, snapshot.errors)
+
+    @_with_reconnect
+    async def write(self, vars: list[GrmVariable]) -> None:
+        """写入列表中变量的值"""
+
+        lines, _ = await self._exdata(write_body(vars), "W")
+        parse_write(vars, lines)
+
+    @_with_reconnect
+    async def info(self) -> GrmModuleInfo:
+        lines, encoding = await self._exdata("", "I")
+        return parse_info(self._module_id, lines, encoding)
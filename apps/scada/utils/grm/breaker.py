@@ -0,0 +1,190 @@
+import contextvars
+import threading
+import time
+
+
+class CircuitBreaker:
+    """模块连接熔断器
+
+    连续失败threshold次后打开，打开期间的请求直接失败；
+    等待backoff秒后进入半开状态放行一个试探请求，
+    试探成功则关闭，失败则重新打开并且等待时间加倍，最长max_backoff秒
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, threshold=3, backoff=5, max_backoff=300) -> None:
+        self._threshold = threshold
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._open_seconds = backoff
+        self._retry_at = 0.0
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() >= self._retry_at:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """是否允许发送请求"""
+
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+
+            if self._state == self.OPEN:
+                if time.monotonic() < self._retry_at:
+                    return False
+                self._state = self.HALF_OPEN
+                self._trial = False
+
+            # 半开状态只放行一个试探请求
+            if self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def success(self):
+        """请求成功"""
+
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._open_seconds = self._backoff
+            self._trial = False
+
+    def failure(self):
+        """请求失败"""
+
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self._threshold:
+                if self._state == self.HALF_OPEN:
+                    # 试探失败，等待时间加倍
+                    self._open_seconds = min(self._open_seconds * 2, self._max_backoff)
+                self._state = self.OPEN
+                self._retry_at = time.monotonic() + self._open_seconds
+                self._trial = False
+
+
+class CacheCircuitBreaker:
+    """状态保存在共享缓存中的熔断器
+
+    规则和CircuitBreaker一样，API的各个worker和采集进程共用一个状态，
+    一个进程发现模块不可用后其他进程直接失败，半开时所有进程只放行一个试探请求。
+    cache需要提供Django缓存的get_many/set/add/incr/delete接口，
+    连续失败次数是近似值，多进程同时失败时可能多计或者少计
+    """
+
+    CLOSED = CircuitBreaker.CLOSED
+    OPEN = CircuitBreaker.OPEN
+    HALF_OPEN = CircuitBreaker.HALF_OPEN
+
+    def __init__(
+        self, cache, module_id: str, threshold=3, backoff=5, max_backoff=300
+    ) -> None:
+        self._cache = cache
+        self._threshold = threshold
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._key = f"grm:breaker:{module_id}"
+        self._failures_key = f"{self._key}:failures"
+        self._trial_key = f"{self._key}:trial"
+        # 每个线程和协程记录自己是否持有试探请求，以及上次读取时缓存中是否有状态，
+        # 同一个进程的并行请求共用这个对象
+        self._trial = contextvars.ContextVar(f"{self._key}:trial", default=False)
+        self._dirty = contextvars.ContextVar(f"{self._key}:dirty", default=True)
+
+    def _load(self) -> dict:
+        data = self._cache.get_many([self._key, self._failures_key])
+        self._dirty.set(bool(data))
+        return data.get(self._key)
+
+    @property
+    def state(self) -> str:
+        opened = self._load()
+        if opened is None:
+            return self.CLOSED
+        if time.time() >= opened["retry_at"]:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self) -> bool:
+        """是否允许发送请求"""
+
+        self._trial.set(False)
+        opened = self._load()
+        if opened is None:
+            return True
+        if time.time() < opened["retry_at"]:
+            return False
+
+        # 半开状态所有进程只放行一个试探请求，试探超时后可以再放行
+        trial = self._cache.add(self._trial_key, 1, self._max_backoff)
+        self._trial.set(trial)
+        return trial
+
+    def success(self):
+        """请求成功"""
+
+        self._trial.set(False)
+        # 成功时只在上次读取到状态时清理，避免每次请求都写缓存
+        if self._dirty.get():
+            self._cache.delete_many([self._key, self._failures_key, self._trial_key])
+            self._dirty.set(False)
+
+    def failure(self):
+        """请求失败"""
+
+        trial = self._trial.get()
+        self._trial.set(False)
+        self._dirty.set(True)
+        self._cache.add(self._failures_key, 0, self._max_backoff)
+        try:
+            failures = self._cache.incr(self._failures_key)
+        except ValueError:
+            failures = 1
+
+        if not trial and failures < self._threshold:
+            return
+
+        # 试探失败，等待时间加倍
+        opened = self._cache.get(self._key)
+        open_seconds = self._backoff
+        if trial and opened:
+            open_seconds = min(opened["open_seconds"] * 2, self._max_backoff)
+        self._cache.set(
+            self._key,
+            {"open_seconds": open_seconds, "retry_at": time.time() + open_seconds},
+            # 保留到加倍后的等待时间之后，试探失败时还能读到上次的等待时间
+            self._max_backoff * 2,
+        )
+        self._cache.delete_many([self._failures_key, self._trial_key])
+
+
+_breakers: dict[tuple[str, bool], CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(module_id: str, cache=None) -> CircuitBreaker:
+    """获取模块的熔断器
+
+    指定cache时状态保存在共享缓存中，所有进程共享；否则只在同一进程内共享
+    """
+
+    key = (module_id, cache is None)
+    with _breakers_lock:
+        if key not in _breakers:
+            if cache is None:
+                _breakers[key] = CircuitBreaker()
+            else:
+                _breakers[key] = CacheCircuitBreaker(cache, module_id)
+        return _breakers[key]
@@ -1,8 +1,47 @@
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
 from datetime import datetime
 
 import requests
 
+from apps.scada.utils.grm.breaker import CircuitBreaker, get_breaker
+from apps.scada.utils.grm.lease import CacheSidLease
+from apps.scada.utils.grm.parser import parse_enumerate, parse_read, split_lines
 from apps.scada.utils.grm.schemas import GrmModuleInfo, GrmModuleToken, GrmVariable
+from apps.scada.utils.grm.snapshot import GrmSnapshot
+from apps.scada.utils.grm.transport import GrmTransport, get_transport
+
+# 分批读取共用的线程池
+_chunk_executor: ThreadPoolExecutor = None
+_chunk_lock = threading.Lock()
+
+
+def configure_chunk_executor(max_workers=16) -> ThreadPoolExecutor:
+    """设置进程内分批读取的线程数，需要在创建客户端之前调用"""
+
+    global _chunk_executor
+
+    with _chunk_lock:
+        if _chunk_executor:
+            _chunk_executor.shutdown(wait=False)
+        _chunk_executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="grm_read"
+        )
+        return _chunk_executor
+
+
+def get_chunk_executor() -> ThreadPoolExecutor:
+    """获取进程内分批读取的线程池"""
+
+    global _chunk_executor
+
+    with _chunk_lock:
+        if _chunk_executor is None:
+            _chunk_executor = ThreadPoolExecutor(
+                max_workers=16, thread_name_prefix="grm_read"
+            )
+        return _chunk_executor
 
 
 class GrmError(Exception):
@@ -14,6 +53,90 @@ class GrmError(Exception):
         return f"grm error code: {self.code}, message: {self.message}"
 
 
+# 以下是同步和异步客户端共用的协议处理，只处理请求体和响应行，不涉及传输
+
+
+def logon_body(module_id: str, module_secret: str) -> str:
+    return f"GRM={module_id}\r\nPASS={module_secret}"
+
+
+def parse_logon(module_id: str, lines: list[bytes], encoding: str) -> GrmModuleToken:
+    """解析登录结果，返回数据地址和SID"""
+
+    results = [line.decode(encoding) for line in lines]
+
+    if results[0] == "OK":
+        return GrmModuleToken(
+            id=module_id,
+            sid=results[2].split("=")[1],
+            data_url=results[1].split("=")[1],
+        )
+    elif results[0] == "ERROR":
+        raise GrmError(int(results[1]), results[2])
+    else:
+        raise GrmError(-1, "未知错误")
+
+
+def exdata_url(token: GrmModuleToken, op: str) -> str:
+    return f"http://{token.data_url}/exdata?SID={token.sid}&OP={op}"
+
+
+def parse_exdata(lines: list[bytes], encoding: str) -> list[bytes]:
+    """检查数据接口的结果，返回OK之后的行"""
+
+    if lines[0] == b"OK":
+        return lines[1:]
+    elif lines[0] == b"ERROR":
+        raise GrmError(int(lines[1]), lines[2].decode(encoding))
+    else:
+        raise GrmError(-1, "未知错误")
+
+
+def read_body(names: list[str], indices) -> str:
+    data = f"{len(indices)}\r\n"
+    return data + "\r\n".join([names[i] for i in indices])
+
+
+def write_body(vars: list[GrmVariable]) -> str:
+    data = f"{len(vars)}\r\n"
+    for v in vars:
+        data = data + v.name + f"\r\n{v.value}\r\n"
+    return data
+
+
+def parse_write(vars: list[GrmVariable], lines: list[bytes]) -> None:
+    """写入结果的错误码写回变量"""
+
+    n = int(lines[0])
+    for v, r in zip(vars, lines[1 : n + 1]):
+        v.write_error = int(r)
+
+
+def parse_info(module_id: str, lines: list[bytes], encoding: str) -> GrmModuleInfo:
+    format_str = "%Y%m%d%H%M%S%f"  # 时间格式，包括毫秒部分
+    lines = [line.decode(encoding) for line in lines]
+
+    return GrmModuleInfo(
+        id=module_id,
+        name=lines[0],
+        desc=lines[1],
+        logo=lines[2],
+        logon_clients=int(lines[3]),
+        status=int(lines[4]),
+        logon_at=datetime.strptime(lines[5], format_str),
+        last_activate=datetime.strptime(lines[6], format_str),
+        logon_ip=lines[7],
+    )
+
+
+def split_chunks(indices, size: int) -> list:
+    """变量数量超过size时按size分批，size为0时不分批"""
+
+    if not size or len(indices) <= size:
+        return [indices]
+    return [indices[i : i + size] for i in range(0, len(indices), size)]
+
+
 class GrmClient:
     req_header = {
         "Accept": "*/*",
@@ -28,6 +151,12 @@ class GrmClient:
         module_url: str,
         timeout=5,
         reconnect=True,
+        transport: GrmTransport = None,
+        chunk_size=0,
+        executor: Executor = None,
+        lease: CacheSidLease = None,
+        observer=None,
+        breaker: CircuitBreaker = None,
     ) -> None:
         self._module_id = module_id
         self._module_secret = module_secret
@@ -35,61 +164,88 @@ class GrmClient:
         self._timeout = timeout
         self._reconnect = reconnect
         self._module_token: GrmModuleToken = None
+        # 默认使用进程内共享的连接池
+        self._transport = transport or get_transport()
+        # 变量很多时分批并行读取，0表示不分批
+        self._chunk_size = chunk_size
+        self._executor = executor or get_chunk_executor()
+        self._logon_lock = threading.Lock()
+        # 配置租约时和其他进程共享SID
+        self._lease = lease
+        self._sid_ttl = lease.ttl if lease else 540
+        self._used_at = 0.0
+        # 请求统计回调 observer(op, seconds, sent_bytes, received_bytes)，登录的op为L
+        self._observer = observer
+        # 默认和其他客户端共享模块的熔断器，配置租约时通过同一个缓存跨进程共享
+        self._breaker = breaker or get_breaker(
+            module_id, lease.cache if lease else None
+        )
 
-    def _exdata(self, data: str, op: str) -> list[str]:
-        """GRM数据获取接口"""
-
-        token = self._module_token
-        url = f"http://{token.data_url}/exdata?SID={token.sid}&OP={op}"
+    def _post(self, url: str, data: str, op: str) -> tuple[list[bytes], str]:
+        """发送请求，返回按行拆分的响应和响应的编码，行不解码"""
+
+        # 熔断期间直接失败，不占用连接和线程
+        if not self._breaker.allow():
+            raise GrmError(-2, f"模块连接熔断 {self._breaker.state}")
+
+        body = data.encode("utf-8")
+        received = 0
+        started = time.perf_counter()
+        try:
+            resp = self._transport.post(
+                url=url,
+                headers=self.req_header,
+                data=body,
+                timeout=self._timeout,
+                idempotent=op != "W",
+            )
+            received = len(resp.content)
+        except requests.RequestException as e:
+            self._breaker.failure()
+            raise GrmError(-1, f"HTTP请求错误 {e}")
+        finally:
+            if self._observer:
+                self._observer(op, time.perf_counter() - started, len(body), received)
 
-        resp = requests.post(
-            url=url,
-            headers=self.req_header,
-            data=data.encode("utf-8"),
-            timeout=self._timeout,
-        )
         if resp.status_code != 200:
+            self._breaker.failure()
             raise GrmError(resp.status_code, "HTTP连接错误")
-        
-        results = resp.text.split("\r\n")
 
-        if results[0] == "OK":
-            return results[1:]
-        elif results[0] == "ERROR":
-            raise GrmError(int(results[1]), results[2])
-        else:
-            raise GrmError(-1, "未知错误")
+        # 模块返回的ERROR也说明连接正常
+        self._breaker.success()
+        return split_lines(resp.content), resp.encoding or "utf-8"
+
+    def _exdata(self, data: str, op: str) -> tuple[list[bytes], str]:
+        """GRM数据获取接口，返回OK之后的行和响应的编码"""
+
+        token = self._module_token
+        results, encoding = self._post(exdata_url(token, op), data, op)
+
+        lines = parse_exdata(results, encoding)
+        self._used_at = time.monotonic()
+        if self._lease:
+            self._lease.touch(token)
+        return lines, encoding
 
     def _exlogon(self) -> GrmModuleToken:
         """GRM模块登录"""
 
-        data = f"GRM={self._module_id}\r\nPASS={self._module_secret}"
+        data = logon_body(self._module_id, self._module_secret)
         url = f"{self._module_url}/exlog"
 
-        resp = requests.post(
-            url=url, headers=self.req_header, data=data, timeout=self._timeout
-        )
-        if resp.status_code != 200:
-            raise GrmError(resp.status_code, "HTTP连接错误")
-
-        results = resp.text.split("\r\n")
-
-        if results[0] == "OK":
-            self._module_token = GrmModuleToken(
-                id=self._module_id,
-                sid=results[2].split("=")[1],
-                data_url=results[1].split("=")[1],
-            )
-            return self._module_token
-        elif results[0] == "ERROR":
-            raise GrmError(int(results[1]), results[2])
-        else:
-            raise GrmError(-1, "未知错误")
+        lines, encoding = self._post(url, data, "L")
+        self._module_token = parse_logon(self._module_id, lines, encoding)
+        self._used_at = time.monotonic()
+        return self._module_token
 
     @property
     def token(self):
         return self._module_token
 
+    @property
+    def breaker(self) -> CircuitBreaker:
+        return self._breaker
+
     def connect(self, token: GrmModuleToken = None, force=False) -> GrmModuleToken:
         """连接到模块数据
         1、SID对于每个模块有最大数量限制
@@ -105,93 +261,131 @@ class GrmClient:
             return self._module_token
         else:
             # 获取新的Token
+            return self._logon(self._module_token if force else None)
+
+    def _logon(self, failed: GrmModuleToken = None) -> GrmModuleToken:
+        """获取SID，配置了租约时优先使用其他进程登录的SID
+
+        failed是已经失效的SID，租约里还是这个SID时重新登录
+        """
+
+        if self._lease is None:
             return self._exlogon()
 
+        with self._lease.lock(self._module_id):
+            token = self._lease.get(self._module_id)
+            if token and (failed is None or token.sid != failed.sid):
+                self._module_token = token
+                self._used_at = time.monotonic()
+                return token
+
+            token = self._exlogon()
+            self._lease.put(token)
+            return token
+
     def _with_reconnect(fn):
         """自动重连装饰器，用于返回错误8的时候重新连接"""
 
         def wrapper(self, *args, **kwargs):
-            if self._reconnect:
-                try:
-                    result = fn(self, *args, **kwargs)
-                except GrmError as err:
-                    if err.code == 8:
-                        # 错误8则刷新sid
-                        self._exlogon()
-                    else:
-                        raise err
-            result = fn(self, *args, **kwargs)
-            return result
+            token = self._module_token
+            if (
+                self._reconnect
+                and token
+                and time.monotonic() - self._used_at > self._sid_ttl
+            ):
+                # SID长时间没用可能已经过期，提前刷新，租约有效说明其他进程还在使用
+                with self._logon_lock:
+                    if self._module_token is token:
+                        self._logon()
+                token = self._module_token
+
+            try:
+                return fn(self, *args, **kwargs)
+            except GrmError as err:
+                if self._reconnect and err.code == 8:
+                    # 错误8则刷新sid后重试一次，并行请求只需要一个刷新
+                    with self._logon_lock:
+                        if self._module_token is token:
+                            self._logon(token)
+                    return fn(self, *args, **kwargs)
+                raise err
 
         return wrapper
 
-    @_with_reconnect
     def enumerate(self) -> list[GrmVariable]:
         """枚举模块变量"""
 
-        lines = self._exdata("NTRPG", "E")
-        n = int(lines[0])
-        vars: list[GrmVariable] = []
-
-        for row in lines[1 : n + 1]:
-            fields = row.split(",")
-            vars.append(
-                GrmVariable(
-                    module_number=self._module_id,
-                    name=fields[0],
-                    type=fields[1],
-                    rw=(fields[2] == "W"),
-                    priority=int(fields[3]),
-                    group=fields[4],
-                )
-            )
-        return vars
+        return self.enumerate_snapshot().to_variables()
 
     @_with_reconnect
+    def enumerate_snapshot(self) -> GrmSnapshot:
+        """枚举模块变量，返回不含值的快照"""
+
+        lines, encoding = self._exdata("NTRPG", "E")
+        names, types, rws, priorities, groups = parse_enumerate(lines, encoding)
+
+        return GrmSnapshot(self._module_id, names, types, rws, priorities, groups)
+
     def read(self, vars: list[GrmVariable]) -> None:
         """读取列表中的变量值"""
 
-        data = f"{len(vars)}\r\n"
-        data = data + "\r\n".join([v.name for v in vars])
+        snapshot = GrmSnapshot.from_variables(vars)
+        self.read_snapshot(snapshot)
+
+        for var, value, error in zip(vars, snapshot.values, snapshot.errors):
+            # 读取错误时保留原来的值
+            var.read_error = error
+            if error == 0:
+                var.value = value
+
+    def read_snapshot(self, snapshot: GrmSnapshot, indices: list[int] = None) -> None:
+        """读取快照中指定下标的变量值，默认读取全部
+
+        变量数量超过chunk_size时分批并行读取，第一批在调用线程中读取，
+        其余批次交给线程池；某一批失败只设置该批变量的错误码，
+        全部失败时抛出第一个错误
+        """
 
-        lines = self._exdata(data, "R")
-        n = int(lines[0])
+        if indices is None:
+            indices = range(len(snapshot))
 
-        for var, row in zip(vars, lines[1 : n + 1]):
-            if row.startswith("#ERROR#"):
-                # 给变量设置错误状态
-                var.read_error = int(row[7:])
-            else:
-                var.read_error = 0
-                var.value = float(row)
+        chunks = split_chunks(indices, self._chunk_size)
+        if len(chunks) == 1:
+            self._read(snapshot, indices)
+            return
+
+        futures = [self._executor.submit(self._read, snapshot, c) for c in chunks[1:]]
+
+        def _inline():
+            self._read(snapshot, chunks[0])
+
+        errors: list[GrmError] = []
+        for chunk, wait in zip(chunks, [_inline] + [f.result for f in futures]):
+            try:
+                wait()
+            except GrmError as err:
+                errors.append(err)
+                for i in chunk:
+                    snapshot.errors[i] = err.code
+
+        if len(errors) == len(chunks):
+            raise errors[0]
 
     @_with_reconnect
-    def write(self, vars: list[GrmVariable]) -> None:
-        """写入列表中变量的值"""
+    def _read(self, snapshot: GrmSnapshot, indices: list[int]) -> None:
+        """读取一批变量的值"""
 
-        data = f"{len(vars)}\r\n"
-        for v in vars:
-            data = data + v.name + f"\r\n{v.value}\r\n"
+        lines, _ = self._exdata(read_body(snapshot.names, indices), "R")
+        parse_read(lines, indices, snapshot.values, snapshot.errors)
 
-        lines = self._exdata(data, "W")
-        n = int(lines[0])
+    @_with_reconnect
+    def write(self, vars: list[GrmVariable]) -> None:
+        """写入列表中变量的值"""
 
-        for v, r in zip(vars, lines[1 : n + 1]):
-            v.write_error = int(r)
+        lines, _ = self._exdata(write_body(vars), "W")
+        parse_write(vars, lines)
 
     @_with_reconnect
     def info(self) -> GrmModuleInfo:
-        format_str = "%Y%m%d%H%M%S%f"  # 时间格式，包括毫秒部分
-        lines = self._exdata("", "I")
-
-        return GrmModuleInfo(
-            id=self._module_id,
-            name=lines[0],
-            desc=lines[1],
-            logo=lines[2],
-            logon_clients=int(lines[3]),
-            status=int(lines[4]),
-            logon_at=datetime.strptime(lines[5], format_str),
-            last_activate=datetime.strptime(lines[6], format_str),
-            logon_ip=lines[7],
-        )
+        lines, encoding = self._exdata("", "I")
+        return parse_info(self._module_id, lines, encoding)
@@ -0,0 +1,81 @@
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from apps.scada.utils.grm.schemas import GrmModuleToken
+
+
+class CacheSidLease:
+    """使用共享缓存保存模块的SID租约
+
+    API的各个worker和采集进程共用一个SID，避免超过模块的SID数量限制。
+    cache需要提供Django缓存的get/set/add/delete接口，
+    多进程共享时需要使用Redis之类的共享缓存。
+    """
+
+    def __init__(self, cache, ttl=540, touch_interval=60, lock_timeout=10) -> None:
+        self._cache = cache
+        # SID不活跃10分钟过期，租约提前失效
+        self._ttl = ttl
+        self._touch_interval = touch_interval
+        self._lock_timeout = lock_timeout
+        self._touched: dict[str, float] = {}
+        self._touched_lock = threading.Lock()
+
+    def _key(self, module_id: str) -> str:
+        return f"grm:sid:{module_id}"
+
+    @property
+    def ttl(self) -> int:
+        return self._ttl
+
+    @property
+    def cache(self):
+        return self._cache
+
+    def get(self, module_id: str) -> GrmModuleToken:
+        """获取有效的SID，没有则返回None"""
+
+        data = self._cache.get(self._key(module_id))
+        return GrmModuleToken(**data) if data else None
+
+    def put(self, token: GrmModuleToken):
+        """保存新登录的SID"""
+
+        self._cache.set(self._key(token.id), token.dict(), self._ttl)
+        with self._touched_lock:
+            self._touched[token.id] = time.monotonic()
+
+    def touch(self, token: GrmModuleToken):
+        """SID使用后延长租约，限制写缓存的频率"""
+
+        now = time.monotonic()
+        with self._touched_lock:
+            if now - self._touched.get(token.id, 0) < self._touch_interval:
+                return
+            self._touched[token.id] = now
+
+        # 只延长仍然是同一个SID的租约
+        current = self.get(token.id)
+        if current and current.sid == token.sid:
+            self._cache.set(self._key(token.id), token.dict(), self._ttl)
+
+    @contextmanager
+    def lock(self, module_id: str):
+        """跨进程的登录锁，超时后不再等待"""
+
+        key = f"{self._key(module_id)}:lock"
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + self._lock_timeout
+
+        acquired = self._cache.add(key, owner, self._lock_timeout)
+        while not acquired and time.monotonic() < deadline:
+            time.sleep(0.1)
+            acquired = self._cache.add(key, owner, self._lock_timeout)
+
+        try:
+            yield
+        finally:
+            if acquired and self._cache.get(key) == owner:
+                self._cache.delete(key)
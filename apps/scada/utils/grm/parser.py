@@ -0,0 +1,76 @@
+from array import array
+from itertools import compress, repeat
+
+# 读取错误的行以这个前缀开始，后面是错误码
+ERROR_PREFIX = b"#ERROR#"
+
+
+def split_lines(body: bytes) -> list[bytes]:
+    """按行拆分响应，不解码"""
+
+    return body.split(b"\r\n")
+
+
+def parse_enumerate(
+    lines: list[bytes], encoding="utf-8"
+) -> tuple[list[str], list[str], array, array, list[str]]:
+    """解析枚举结果，返回名称、类型、读写、优先级和分组
+
+    每行为 名称,类型,读写,优先级,分组，所有行一次解码后按逗号拆分，
+    字段数量不一致时逐行解析
+    """
+
+    n = int(lines[0])
+    rows = lines[1 : n + 1]
+    fields = b",".join(rows).decode(encoding).split(",")
+
+    if len(fields) != 5 * len(rows):
+        fields = []
+        for row in rows:
+            fields.extend(row.decode(encoding).split(",")[:5])
+
+    return (
+        fields[0::5],
+        fields[1::5],
+        array("b", [rw == "W" for rw in fields[2::5]]),
+        array("b", map(int, fields[3::5])),
+        fields[4::5],
+    )
+
+
+def parse_read(lines: list[bytes], indices, values: array, errors: array) -> None:
+    """解析读取结果，值和错误码直接写入快照的数组
+
+    float可以直接转换bytes，整批转换失败说明有错误行，
+    用map批量判断前缀后只逐个处理错误行，读取错误的变量保留原来的值
+    """
+
+    n = int(lines[0])
+    rows = lines[1 : n + 1]
+    codes = array("i", bytes(4 * len(rows)))
+
+    try:
+        parsed = array("d", map(float, rows))
+    except ValueError:
+        failed = list(
+            compress(
+                range(len(rows)), map(bytes.startswith, rows, repeat(ERROR_PREFIX))
+            )
+        )
+        for k in failed:
+            codes[k] = int(rows[k][len(ERROR_PREFIX) :])
+            rows[k] = b"nan"
+        parsed = array("d", map(float, rows))
+        for k in failed:
+            parsed[k] = values[indices[k]]
+
+    # 连续下标直接按切片整体赋值
+    if isinstance(indices, range) and indices.step == 1 and len(indices) == len(parsed):
+        values[indices.start : indices.stop] = parsed
+        errors[indices.start : indices.stop] = codes
+        return
+
+    for i, value in zip(indices, parsed):
+        values[i] = value
+    for i, code in zip(indices, codes):
+        errors[i] = code
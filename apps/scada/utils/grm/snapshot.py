@@ -0,0 +1,101 @@
+import sys
+from array import array
+
+from apps.scada.utils.grm.schemas import GrmVariable
+
+
+class GrmSnapshot:
+    """模块变量的紧凑快照
+
+    采集热路径不创建GrmVariable对象，变量的名称、类型等枚举信息在枚举后固定，
+    值和错误码保存在并行数组中，只在API边界和GrmVariable互相转换
+    """
+
+    __slots__ = (
+        "module_number",
+        "names",
+        "index",
+        "types",
+        "rws",
+        "priorities",
+        "groups",
+        "values",
+        "errors",
+        "changed",
+    )
+
+    def __init__(
+        self,
+        module_number: str,
+        names: list[str],
+        types: list[str],
+        rws: array = None,
+        priorities: array = None,
+        groups: list[str] = None,
+    ) -> None:
+        n = len(names)
+        self.module_number = module_number
+        # 名称和类型大量重复，使用驻留字符串
+        self.names = [sys.intern(name) for name in names]
+        # 变量名 -> 下标
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.types = [sys.intern(t) for t in types]
+        self.rws = rws if rws is not None else array("b", bytes(n))
+        self.priorities = priorities if priorities is not None else array("b", bytes(n))
+        self.groups = [sys.intern(g) for g in groups] if groups else [""] * n
+        self.values = array("d", bytes(8 * n))
+        self.errors = array("i", bytes(4 * n))
+        # 本次轮询是否产生了需要推送的新值，默认都视为变化
+        self.changed = array("b", b"\x01" * n)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def copy(self) -> "GrmSnapshot":
+        """复制值和错误码，枚举信息共享"""
+
+        other = GrmSnapshot.__new__(GrmSnapshot)
+        other.module_number = self.module_number
+        other.names = self.names
+        other.index = self.index
+        other.types = self.types
+        other.rws = self.rws
+        other.priorities = self.priorities
+        other.groups = self.groups
+        other.values = array("d", self.values)
+        other.errors = array("i", self.errors)
+        other.changed = array("b", self.changed)
+        return other
+
+    @classmethod
+    def from_variables(cls, vars: list[GrmVariable]) -> "GrmSnapshot":
+        """从GrmVariable列表构建快照"""
+
+        snapshot = cls(
+            vars[0].module_number if vars else "",
+            [v.name for v in vars],
+            [v.type for v in vars],
+            rws=array("b", [v.rw for v in vars]),
+            priorities=array("b", [v.priority for v in vars]),
+            groups=[v.group for v in vars],
+        )
+        snapshot.values = array("d", [v.value for v in vars])
+        snapshot.errors = array("i", [v.read_error for v in vars])
+        return snapshot
+
+    def to_variables(self) -> list[GrmVariable]:
+        """转换为GrmVariable列表"""
+
+        return [
+            GrmVariable(
+                module_number=self.module_number,
+                name=self.names[i],
+                type=self.types[i],
+                rw=bool(self.rws[i]),
+                priority=self.priorities[i],
+                group=self.groups[i],
+                value=self.values[i],
+                read_error=self.errors[i],
+            )
+            for i in range(len(self.names))
+        ]
@@ -0,0 +1,143 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ReadTimeoutError
+from urllib3.util.retry import Retry
+
+
+class GrmTransportStats:
+    """连接复用计数"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+
+    def incr(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def to_dict(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "connections": self.connections,
+                "reused": self.requests - self.connections,
+            }
+
+
+class GrmRetry(Retry):
+    """读取超时说明请求已经发到模块，不再重发，避免重复执行和超时时间翻倍"""
+
+    def increment(self, method=None, url=None, *args, error=None, **kwargs):
+        if isinstance(error, ReadTimeoutError):
+            raise error
+        return super().increment(method, url, *args, error=error, **kwargs)
+
+
+def _counting_pool(pool_cls, stats: GrmTransportStats):
+    """统计新建连接数量的连接池"""
+
+    class CountingPool(pool_cls):
+        def _new_conn(self):
+            stats.incr("connections")
+            return super()._new_conn()
+
+    CountingPool.__name__ = pool_cls.__name__
+    return CountingPool
+
+
+class GrmTransport:
+    """GRM的HTTP传输层
+
+    使用Session保持长连接，同一个上游地址的请求复用连接池；
+    写入请求使用单独的Session，只重试没有建立的连接
+    """
+
+    def __init__(self, pool_size=10, retries=1, connect_timeout=3) -> None:
+        self._connect_timeout = connect_timeout
+        self.stats = GrmTransportStats()
+
+        # 只重试连接失败和服务端断开的复用连接，不重试读取超时和HTTP状态码
+        self._session = self._new_session(
+            pool_size,
+            GrmRetry(
+                total=retries,
+                connect=retries,
+                read=retries,
+                status=0,
+                allowed_methods=None,
+                raise_on_status=False,
+            ),
+        )
+        # 写入不是幂等的，请求可能已经发出时都不重试
+        self._write_session = self._new_session(
+            pool_size,
+            Retry(
+                total=retries,
+                connect=retries,
+                read=0,
+                status=0,
+                allowed_methods=None,
+                raise_on_status=False,
+            ),
+        )
+
+    def _new_session(self, pool_size: int, retry: Retry) -> requests.Session:
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+        )
+        adapter.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool(HTTPConnectionPool, self.stats),
+            "https": _counting_pool(HTTPSConnectionPool, self.stats),
+        }
+
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def post(
+        self, url: str, headers: dict, data: bytes, timeout, idempotent=True
+    ) -> requests.Response:
+        self.stats.incr("requests")
+        session = self._session if idempotent else self._write_session
+        return session.post(
+            url=url,
+            headers=headers,
+            data=data,
+            timeout=(min(self._connect_timeout, timeout), timeout),
+        )
+
+    def close(self):
+        self._session.close()
+        self._write_session.close()
+
+
+_default_transport: GrmTransport = None
+_default_lock = threading.Lock()
+
+
+def configure_transport(**kwargs) -> GrmTransport:
+    """设置进程内共享的传输层参数，需要在创建客户端之前调用"""
+
+    global _default_transport
+
+    with _default_lock:
+        if _default_transport:
+            _default_transport.close()
+        _default_transport = GrmTransport(**kwargs)
+        return _default_transport
+
+
+def get_transport() -> GrmTransport:
+    """获取进程内共享的传输层"""
+
+    global _default_transport
+
+    with _default_lock:
+        if _default_transport is None:
+            _default_transport = GrmTransport()
+        return _default_transport
@@ -0,0 +1,36 @@
+import bisect
+import hashlib
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing(object):
+    """一致性哈希环
+
+    每个节点在环上放replicas个虚拟节点，节点加入或者离开时
+    只有相邻区间的键会换到别的节点
+    """
+
+    def __init__(self, nodes: list[str] = (), replicas=160):
+        self._replicas = replicas
+        self._keys: list[int] = []
+        self._nodes: list[str] = []
+
+        points = sorted(
+            (_hash(f"{node}#{i}"), node) for node in set(nodes) for i in range(replicas)
+        )
+        self._keys = [p[0] for p in points]
+        self._nodes = [p[1] for p in points]
+
+    def __len__(self) -> int:
+        return len(set(self._nodes))
+
+    def get(self, key: str) -> str:
+        """获取键所在的节点，环为空时返回None"""
+
+        if not self._keys:
+            return None
+        i = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._nodes[i]
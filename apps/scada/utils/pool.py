@@ -1,11 +1,25 @@
 # 每个线程保留一个模块的连接
 import threading
+from django.conf import settings
+from django.core.cache import cache
 from apps.scada.models import Module
 from apps.scada.utils.grm.client import GrmClient
+from apps.scada.utils.grm.lease import CacheSidLease
+from apps.scada.utils.grm.transport import GrmTransport
 
 
 grm_pool_local = threading.local()
 
+# 所有线程共享HTTP连接池
+grm_transport = GrmTransport(
+    pool_size=settings.GRM_HTTP_POOL_SIZE,
+    retries=settings.GRM_HTTP_RETRIES,
+    connect_timeout=settings.GRM_HTTP_CONNECT_TIMEOUT,
+)
+
+# 和其他worker以及采集进程共享SID
+grm_lease = CacheSidLease(cache)
+
 
 def get_grm_client(module: Module) -> GrmClient:
     """缓存使用过的grm客户端"""
@@ -26,7 +40,12 @@ def get_grm_client(module: Module) -> GrmClient:
         return pool[key]
     else:
         client = GrmClient(
-            module.module_number, module.module_secret, module.module_url
+            module.module_number,
+            module.module_secret,
+            module.module_url,
+            timeout=settings.GRM_HTTP_TIMEOUT,
+            transport=grm_transport,
+            lease=grm_lease,
         )
         client.connect()
 
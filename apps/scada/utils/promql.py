@@ -1,27 +1,260 @@
-from urllib.parse import urlencode
-from django.conf import settings
+import hashlib
+import re
+import threading
+import time
+from concurrent.futures import Future
+
 import requests
+from django.conf import settings
+from django.core.cache import cache
+from prometheus_client import Counter, Histogram
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 查询耗时，按接口和结果区分
+query_seconds = Histogram(
+    "scada_promql_query_seconds",
+    "PromQL query latency in seconds",
+    ["endpoint", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+# 响应体大小（解压后）
+response_bytes = Histogram(
+    "scada_promql_response_bytes",
+    "PromQL response body size in bytes",
+    ["endpoint"],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+)
+
+# 查询缓存命中情况，shared为等待同一个查询的结果
+cache_requests = Counter(
+    "scada_promql_cache_requests",
+    "PromQL result cache lookups",
+    ["result"],
+)
+
+# 引号内的字符串和空白，规范化时只压缩字符串外面的空白
+_query_tokens = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|`[^`]*`)|\s+')
+
+# RE2的特殊字符
+_regex_special = re.compile(r"([\\.+*?()|\[\]{}^$])")
+
+# 标签值字符串里需要转义的字符
+_label_special = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n"})
 
 
 class PrometheusQueryError(Exception):
     pass
 
 
-def promql_query(query_str):
-    query_params = urlencode({"query": query_str})
-    url = f"{settings.PROMETHEUS_URL}/api/v1/query?{query_params}"
+class PrometheusClient(object):
+    """Prometheus查询客户端
+
+    每个线程保持一个Session复用长连接，响应使用gzip压缩，
+    查询语句超过post_threshold个字符时改用POST表单提交，
+    每次查询记录耗时和响应大小
+    """
+
+    def __init__(
+        self,
+        url: str,
+        timeout=5,
+        connect_timeout=3,
+        pool_size=10,
+        post_threshold=2048,
+    ):
+        self._url = url.rstrip("/")
+        self._timeout = (min(connect_timeout, timeout), timeout)
+        self._pool_size = pool_size
+        self._post_threshold = post_threshold
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            # 只重试连接失败，读取超时不重试，避免查询耗时翻倍
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=self._pool_size,
+                max_retries=Retry(total=1, read=0),
+            )
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["Accept-Encoding"] = "gzip"
+            self._local.session = session
+        return session
+
+    def _request(self, endpoint: str, params: dict) -> dict:
+        url = f"{self._url}/api/v1/{endpoint}"
+        session = self._session()
+        started = time.perf_counter()
+        status = "error"
 
-    try:
-        response = requests.get(url, timeout=(3, 5))
-        response.raise_for_status()  # Raises HTTPError for bad responses (4xx or 5xx)
-        query_data = response.json()
+        try:
+            if len(params["query"]) > self._post_threshold:
+                resp = session.post(url, data=params, timeout=self._timeout)
+            else:
+                resp = session.get(url, params=params, timeout=self._timeout)
+            response_bytes.labels(endpoint).observe(len(resp.content))
 
-        if query_data["status"] != "success":
-            raise PrometheusQueryError(f'tsdb error {query_data["error"]}')
+            # 查询错误时Prometheus返回4xx和错误信息
+            try:
+                data = resp.json()
+            except ValueError:
+                resp.raise_for_status()
+                raise PrometheusQueryError("tsdb error: invalid response")
+            if data.get("status") != "success":
+                raise PrometheusQueryError(f'tsdb error {data.get("error")}')
 
-        return query_data
-    except requests.RequestException as e:
-        raise PrometheusQueryError(f"tsdb error: {str(e)}")
+            status = "success"
+            return data
+        except requests.RequestException as e:
+            raise PrometheusQueryError(f"tsdb error: {str(e)}")
+        finally:
+            query_seconds.labels(endpoint, status).observe(
+                time.perf_counter() - started
+            )
+
+    def query(self, query: str) -> dict:
+        """即时查询，返回完整的响应"""
+
+        return self._request("query", {"query": query})
+
+    def query_range(self, query: str, start: int, end: int, step: int) -> list:
+        """范围查询，返回结果数组"""
+
+        data = self._request(
+            "query_range", {"query": query, "start": start, "end": end, "step": step}
+        )
+        return data.get("data", {}).get("result", [])
+
+
+def promql_regex_escape(value: str) -> str:
+    """转义为name=~"..."里匹配原文的正则"""
+
+    return _regex_special.sub(r"\\\1", value).translate(_label_special)
+
+
+def normalize_query(query: str) -> str:
+    """去掉首尾空白，字符串外面连续的空白合并成一个空格"""
+
+    return _query_tokens.sub(lambda m: m.group(1) or " ", query.strip())
+
+
+class QueryCache(object):
+    """即时查询的结果缓存
+
+    结果按规范化后的查询语句保存在Django缓存中，有效期和采集周期一致；
+    同一个查询同时只有一个请求到Prometheus，本进程的其它线程等待这个结果，
+    其它进程通过缓存锁等待结果写入缓存，等待超时后自己查询
+    """
+
+    def __init__(self, cache, client: PrometheusClient, lock_timeout=5, poll=0.05):
+        self._cache = cache
+        self._client = client
+        self._lock_timeout = lock_timeout
+        self._poll = poll
+        self._lock = threading.Lock()
+        self._flights: dict[str, Future] = {}
+
+    def _key(self, query: str) -> str:
+        digest = hashlib.sha1(normalize_query(query).encode("utf-8")).hexdigest()
+        return f"promql:{digest}"
+
+    def query(self, query: str, ttl: int) -> dict:
+        """ttl为0时不使用缓存"""
+
+        if ttl <= 0:
+            return self._client.query(query)
+
+        key = self._key(query)
+        data = self._cache.get(key)
+        if data is not None:
+            cache_requests.labels("hit").inc()
+            return data
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Future()
+        if not leader:
+            cache_requests.labels("shared").inc()
+            return flight.result()
+
+        cache_requests.labels("miss").inc()
+        try:
+            data = self._fetch(key, query, ttl)
+            flight.set_result(data)
+            return data
+        except Exception as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+    def _fetch(self, key: str, query: str, ttl: int) -> dict:
+        lock_key = f"{key}:lock"
+        acquired = self._cache.add(lock_key, 1, self._lock_timeout)
+
+        # 其它进程正在查询，等待结果写入缓存
+        deadline = time.monotonic() + self._lock_timeout
+        while not acquired and time.monotonic() < deadline:
+            time.sleep(self._poll)
+            data = self._cache.get(key)
+            if data is not None:
+                return data
+
+        try:
+            data = self._client.query(query)
+            self._cache.set(key, data, ttl)
+            return data
+        finally:
+            if acquired:
+                self._cache.delete(lock_key)
+
+
+_default_client: PrometheusClient = None
+_default_cache: QueryCache = None
+_default_lock = threading.Lock()
+
+
+def get_prometheus_client() -> PrometheusClient:
+    """获取进程内共享的查询客户端"""
+
+    global _default_client
+
+    with _default_lock:
+        if _default_client is None:
+            _default_client = PrometheusClient(
+                settings.PROMETHEUS_URL,
+                timeout=settings.PROMETHEUS_TIMEOUT,
+                connect_timeout=settings.PROMETHEUS_CONNECT_TIMEOUT,
+                pool_size=settings.PROMETHEUS_POOL_SIZE,
+                post_threshold=settings.PROMETHEUS_POST_THRESHOLD,
+            )
+        return _default_client
+
+
+def get_query_cache() -> QueryCache:
+    """获取进程内共享的查询缓存"""
+
+    global _default_cache
+
+    client = get_prometheus_client()
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = QueryCache(cache, client)
+        return _default_cache
+
+
+def promql_query(query_str, ttl=0):
+    """即时查询，ttl大于0时结果缓存ttl秒"""
+
+    return get_query_cache().query(query_str, ttl)
 
 
 def promql_query_range(
@@ -42,24 +275,4 @@ def promql_query_range(
     Returns:
     - list: Result array or raise an error.
     """
-    try:
-        # Prepare the request parameters
-        params = {
-            "query": query,
-            "start": start_time,
-            "end": end_time,
-            "step": step,
-        }
-
-        # Make the request to Prometheus API
-        response = requests.get(
-            f"{settings.PROMETHEUS_URL}/api/v1/query_range", params=params
-        )
-        response.raise_for_status()  # Raise an HTTPError for bad responses
-
-        # Parse and return the result array from the JSON response
-        result = response.json().get("data", {}).get("result", [])
-        return result
-
-    except requests.exceptions.RequestException as e:
-        raise PrometheusQueryError(f"tsdb error: {str(e)}")
+    return get_prometheus_client().query_range(query, start_time, end_time, step)
@@ -0,0 +1,232 @@
+import logging
+import struct
+import threading
+from collections import deque
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+try:
+    import snappy
+
+    _snappy_compress = snappy.compress
+except ImportError:
+    try:
+        import cramjam
+
+        def _snappy_compress(data: bytes) -> bytes:
+            return bytes(cramjam.snappy.compress_raw(data))
+
+    except ImportError:
+        _snappy_compress = None
+
+
+# 时序的标签，按标签名排序的(name, value)元组
+Labels = tuple[tuple[str, str], ...]
+
+
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _field(number: int, data: bytes) -> bytes:
+    """length-delimited字段"""
+
+    return _varint(number << 3 | 2) + _varint(len(data)) + data
+
+
+def encode_write_request(samples: list[tuple[Labels, float, int]]) -> bytes:
+    """编码remote-write的WriteRequest
+
+    samples为(标签, 值, 毫秒时间戳)，同一时序的样本合并到一个TimeSeries，
+    没有引入protobuf依赖，按proto定义手工编码
+    """
+
+    series: dict[Labels, list[bytes]] = {}
+    for labels, value, timestamp in samples:
+        # Sample: double value = 1; int64 timestamp = 2;
+        sample = b"\x09" + struct.pack("<d", value) + b"\x10" + _varint(timestamp)
+        series.setdefault(labels, []).append(_field(2, sample))
+
+    out = bytearray()
+    for labels, encoded in series.items():
+        # Label: string name = 1; string value = 2;
+        ts = b"".join(
+            _field(1, _field(1, name.encode()) + _field(2, value.encode()))
+            for name, value in labels
+        )
+        out += _field(1, ts + b"".join(encoded))
+    return bytes(out)
+
+
+def snappy_compress(data: bytes) -> bytes:
+    """snappy块格式压缩
+
+    优先使用python-snappy或cramjam，都没有安装时只输出字面量块，
+    数据不会变小但是格式合法，接收端可以正常解压
+    """
+
+    if _snappy_compress is not None:
+        return _snappy_compress(data)
+
+    out = bytearray(_varint(len(data)))
+    for start in range(0, len(data), 65536):
+        chunk = data[start : start + 65536]
+        n = len(chunk) - 1
+        if n < 60:
+            out.append(n << 2)
+        elif n < 0x100:
+            out += bytes((60 << 2, n))
+        else:
+            out += bytes((61 << 2,)) + struct.pack("<H", n)
+        out += chunk
+    return bytes(out)
+
+
+class RemoteWriteStats:
+    """推送计数"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def incr(self, name: str, n: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def to_dict(self) -> dict[str, int]:
+        with self._lock:
+            return {"sent": self.sent, "failed": self.failed, "dropped": self.dropped}
+
+
+class RemoteWriter:
+    """Prometheus remote-write推送
+
+    采集器把样本放到内存队列，后台线程按批次压缩推送；
+    网络错误、5xx和429按指数退避重试同一批次，保证同一时序按时间顺序写入，
+    其他4xx错误的批次直接丢弃。队列满时丢弃最旧的样本
+    """
+
+    def __init__(
+        self,
+        url: str,
+        batch_size=2000,
+        queue_size=200000,
+        timeout=10,
+        backoff=1,
+        max_backoff=30,
+    ) -> None:
+        self._url = url
+        self._batch_size = batch_size
+        self._queue_size = queue_size
+        self._timeout = timeout
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._queue: deque[tuple[Labels, float, int]] = deque()
+        # 已经移出队列的样本总数，用来定位正在发送的批次
+        self._head = 0
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread = None
+        self._session = requests.Session()
+        self.stats = RemoteWriteStats()
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def write(self, samples: list[tuple[Labels, float, int]]):
+        """样本入队，不阻塞采集线程"""
+
+        if not samples:
+            return
+
+        with self._lock:
+            self._queue.extend(samples)
+            overflow = len(self._queue) - self._queue_size
+            for _ in range(max(overflow, 0)):
+                self._queue.popleft()
+                self._head += 1
+        if overflow > 0:
+            self.stats.incr("dropped", overflow)
+        self._ready.set()
+
+    def _peek(self) -> tuple[int, list[tuple[Labels, float, int]]]:
+        with self._lock:
+            n = min(len(self._queue), self._batch_size)
+            return self._head, [self._queue[i] for i in range(n)]
+
+    def _discard(self, head: int, n: int):
+        """发送完成后移出队列，发送期间队列溢出时可能已经被丢弃了一部分"""
+
+        with self._lock:
+            for _ in range(max(head + n - self._head, 0)):
+                self._queue.popleft()
+                self._head += 1
+
+    def _send(self, batch: list[tuple[Labels, float, int]]) -> str:
+        """发送一个批次，返回sent、dropped或者需要重试的failed"""
+
+        data = snappy_compress(encode_write_request(batch))
+        try:
+            resp = self._session.post(
+                self._url,
+                data=data,
+                headers={
+                    "Content-Encoding": "snappy",
+                    "Content-Type": "application/x-protobuf",
+                    "X-Prometheus-Remote-Write-Version": "0.1.0",
+                },
+                timeout=self._timeout,
+            )
+        except requests.RequestException as e:
+            logger.error(f"remote write error {e}")
+            return "failed"
+
+        if resp.status_code < 300:
+            return "sent"
+        logger.error(f"remote write http {resp.status_code} {resp.text[:200]}")
+        if resp.status_code >= 500 or resp.status_code == 429:
+            return "failed"
+        return "dropped"
+
+    def _run(self):
+        backoff = self._backoff
+        while not self._stopped.is_set():
+            head, batch = self._peek()
+            if not batch:
+                self._ready.clear()
+                self._ready.wait(1)
+                continue
+
+            result = self._send(batch)
+            self.stats.incr(result, len(batch))
+            if result == "failed":
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2, self._max_backoff)
+                continue
+
+            self._discard(head, len(batch))
+            backoff = self._backoff
+
+    def start(self):
+        """启动推送线程"""
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """停止推送线程，队列中未发送的样本会丢失"""
+
+        self._stopped.set()
+        self._ready.set()
@@ -20,9 +20,25 @@ router.add_router("/site", collector_router)
 router.add_router("/site", videosource_router)
 
 # For prometheus
-from apps.scada.view.collector import service_discover
+from apps.scada.view.collector import (
+    service_discover,
+    node_service_discover,
+    get_collector_nodes,
+)
+from apps.scada.schema.collector import CollectorNodeOut
+from apps.sys.utils import AuthBearer
 from apps.scada.view.alert import create_notify
 
 router.add_api_operation("/collector/sd", ['GET'], service_discover)
+router.add_api_operation("/collector/nodes/sd", ['GET'], node_service_discover)
 router.add_api_operation("/alert/notify", ['POST'], create_notify)
 
+# 采集进程状态
+router.add_api_operation(
+    "/collector/nodes",
+    ["GET"],
+    get_collector_nodes,
+    response=list[CollectorNodeOut],
+    auth=AuthBearer([("scada:collector:edit", "x")]),
+)
+
@@ -1,16 +1,16 @@
-import fcntl
-import os
-import time
-from string import Template
-from xmlrpc.client import ServerProxy
+from datetime import timedelta
+
+import requests
+from django.db.models import Count, Q
 from django.shortcuts import get_object_or_404
 from django.conf import settings
+from django.utils import timezone
 from ninja import Router
-from ninja.errors import HttpError
-from apps.scada.models import Collector, Module
+from apps.scada.models import Collector, CollectorNode, Module
 
 from apps.scada.schema.collector import (
     CollectorIn,
+    CollectorNodeOut,
     CollectorOut,
     CollectorStatusIn,
 )
@@ -20,94 +20,88 @@ from utils.schema.paginate import api_paginate
 
 router = Router()
 
-rpc = ServerProxy(settings.SUPERVISOR_XMLRPC_URL)
+# 读取采集进程内存数据，复用连接
+collector_session = requests.Session()
 
 
-supervisor_tpl = Template(
-    """
-[program:$process_name]
-command=$command
-environment=PYTHONPATH=/app/src,MODULE_NUMBER="$module_number",MODULE_SECRET="$module_secret",MODULE_URL="$module_url",RANDOM_PORT=$port,HOST="$host",ADVERTISE="$advertise"
-autorestart=unexpected
-"""
-)
+def get_heartbeat_deadline():
+    """早于这个时间没有心跳的采集进程视为离线"""
 
+    return timezone.now() - timedelta(seconds=settings.COLLECTOR_HEARTBEAT_TTL)
 
-def supervisor_update():
-    """实现supervisorctl的update命令
-    参考supervisorctl的源码实现, 只是异常交给上层处理
-    """
 
-    result = rpc.supervisor.reloadConfig()
-    added, changed, removed = result[0]
+def is_node_alive(node: CollectorNode) -> bool:
+    """采集进程是否在线"""
+
+    return node is not None and node.heartbeat_at >= get_heartbeat_deadline()
+
 
-    for gname in removed:
-        try:
-            rpc.supervisor.stopProcessGroup(gname)
-            rpc.supervisor.removeProcessGroup(gname)
-        except:
-            continue
+def get_query_ttl(module: Module) -> int:
+    """模块数据的查询缓存时间，和采集周期一致，Prometheus的数据不会更快变化"""
 
-    for gname in changed:
-        try:
-            rpc.supervisor.stopProcessGroup(gname)
-            rpc.supervisor.removeProcessGroup(gname)
-            rpc.supervisor.addProcessGroup(gname)
-        except:
-            continue
+    try:
+        return module.collector.interval
+    except Collector.DoesNotExist:
+        return settings.PROMETHEUS_CACHE_TTL
+
+
+def get_exporter_address(collector: Collector) -> str:
+    """获取采集进程注册的服务地址"""
 
-    for gname in added:
-        try:
-            rpc.supervisor.addProcessGroup(gname)
-        except:
-            continue
+    return collector.node.address
 
 
-def get_proccess_name(collector: Collector):
-    """获取进程名称"""
+def get_metrics_path(collector: Collector) -> str:
+    """获取模块的指标路径"""
 
-    return f"collector_{collector.module.module_number}"
+    return f"/metrics/{collector.module.module_number}"
 
 
-def get_proccess_file(collector: Collector):
-    """获取配置文件路径"""
+def get_exporter_url(collector: Collector) -> str:
+    """获取模块的指标地址"""
 
-    return f"{settings.SUPERVISOR_COLLECTOR_DIR}/{get_proccess_name(collector)}.conf"
+    return f"http://{get_exporter_address(collector)}{get_metrics_path(collector)}"
 
 
-def rewrite_process_config(collector: Collector) -> bool:
-    """更新配置文件"""
+def get_values_url(collector: Collector) -> str:
+    """获取模块内存数据的地址"""
 
-    process_name = get_proccess_name(collector)
-    file_path = get_proccess_file(collector)
+    number = collector.module.module_number
+    return f"http://{get_exporter_address(collector)}/values/{number}"
 
-    # 配置文件内容
-    content = supervisor_tpl.substitute(
-        process_name=process_name,
-        module_number=collector.module.module_number,
-        module_secret=collector.module.module_secret,
-        module_url=collector.module.module_url,
-        command=settings.SUPERVISOR_COLLECTOR_COMMAND,
-        host=settings.SUPERVISOR_COLLECTOR_HOST,
-        port=settings.SUPERVISOR_COLLECTOR_PORT,
-        advertise=settings.SUPERVISOR_COLLECTOR_ADVERTISE,
+
+def read_collector_values(collector: Collector, names: list[str], seconds=0) -> dict:
+    """从采集进程内存读取变量最近的值
+
+    返回 {"since": 内存中最早的快照时间, "values": {变量名: [[时间戳, 值], ...]}}，
+    seconds为0时只返回最新值，采集进程不可用时抛出requests.RequestException
+    """
+
+    resp = collector_session.post(
+        get_values_url(collector),
+        json={"names": names, "seconds": seconds},
+        timeout=(0.5, 1),
     )
-    # 获得文件锁
-    with open(file_path, "w") as file:
-        try:
-            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
-            # 在这里进行其他进程不能创建文件的操作
-            file.write(content)
-        finally:
-            # 释放文件锁
-            fcntl.flock(file, fcntl.LOCK_UN)
+    resp.raise_for_status()
+    return resp.json()
+
 
+def read_node_values(
+    node: CollectorNode, modules: dict[str, list[str]], seconds=0
+) -> dict[str, dict]:
+    """一个请求读取采集进程上多个模块的变量值
 
-def delete_process_config(collector: Collector):
-    """删除配置"""
+    modules为模块编号 -> 变量名列表，返回模块编号 -> read_collector_values的结果，
+    不在这个采集进程上的模块不返回，采集进程不可用时抛出requests.RequestException
+    """
 
-    file_path = get_proccess_file(collector)
-    os.remove(file_path)
+    resp = collector_session.post(
+        f"http://{node.address}/values",
+        json={"modules": modules, "seconds": seconds},
+        timeout=(0.5, 1),
+    )
+    resp.raise_for_status()
+    return resp.json()["modules"]
 
 
 @router.put(
@@ -131,67 +125,73 @@ def create_collector(request, site_id: int, module_id: int, payload: CollectorIn
     collector.timeout = payload.timeout
     collector.save()
 
-    # 刷新
-    rewrite_process_config(collector)
-
-    # 更新守护进程
-    try:
-        supervisor_update()
-    except Exception:
-        raise HttpError(500, "采集器配置失败")
-
+    # 采集进程会定时加载采集器列表，无需重启进程
     return collector
 
 
-def get_exporter_url(process_name: str) -> str:
-    """解析日志里面的服务地址"""
-
-    log = rpc.supervisor.tailProcessStdoutLog(process_name, 0, 255)[0]
-    advertise = ""
-    try:
-        lines = log.splitlines()[::-1]
-
-        for l in lines:
-            if l.startswith("# ADVERTISE"):
-                # 格式是这样的 # ADVERTISE 27.0.0.1:20986
-                advertise = l.split(" ")[2]
-                raise EOFError()
-        return ""
-    except:
-        return advertise
-
-
 def service_discover(request):
     """实现Prometheus的HTTP SD接口
     https://prometheus.io/docs/prometheus/latest/http_sd/
     """
-    collectors = Collector.objects.all()
-    running_list = []
-    for c in collectors:
-        process_name = get_proccess_name(c)
-
-        # 获取进程状态
-        try:
-            info = rpc.supervisor.getProcessInfo(process_name)
-
-            if info["statename"] == "RUNNING":
-                # 加入服务发现
-                running_list.append(
-                    {
-                        "targets": [get_exporter_url(process_name)],
-                        "labels": {
-                            "__scrape_interval__": f"{c.interval}s",
-                            "__scrape_timeout__": f"{c.timeout}s",
-                        },
-                    }
-                )
-        except:
-            # 不需要处理错误
-            continue
+    # 只返回心跳有效的采集进程负责的模块
+    collectors = Collector.objects.filter(
+        enabled=True, node__heartbeat_at__gte=get_heartbeat_deadline()
+    ).select_related("module", "node")
+
+    running_list = [
+        {
+            "targets": [get_exporter_address(c)],
+            "labels": {
+                "__metrics_path__": get_metrics_path(c),
+                "__scrape_interval__": f"{c.interval}s",
+                "__scrape_timeout__": f"{c.timeout}s",
+                "module": c.module.module_number,
+            },
+        }
+        for c in collectors
+    ]
 
     return 200, running_list
 
 
+def node_service_discover(request):
+    """采集进程自身指标的HTTP SD接口
+
+    连接池复用、remote-write推送等进程级别的指标在 /metrics，不属于任何模块
+    """
+    nodes = CollectorNode.objects.filter(heartbeat_at__gte=get_heartbeat_deadline())
+
+    node_list = [
+        {
+            "targets": [node.address],
+            "labels": {
+                "__metrics_path__": "/metrics",
+                "node": node.name,
+            },
+        }
+        for node in nodes
+    ]
+
+    return 200, node_list
+
+
+@api_schema
+def get_collector_nodes(request):
+    """所有采集进程的状态和采集的模块数量"""
+
+    deadline = get_heartbeat_deadline()
+    nodes = CollectorNode.objects.annotate(
+        modules=Count("collector", filter=Q(collector__enabled=True))
+    ).order_by("name")
+
+    outlist: list[CollectorNodeOut] = []
+    for node in nodes:
+        out = CollectorNodeOut.from_orm(node)
+        out.alive = node.heartbeat_at >= deadline
+        outlist.append(out)
+    return outlist
+
+
 @router.get(
     "/{site_id}/module/{module_id}/collector",
     response=list[CollectorOut],
@@ -206,23 +206,21 @@ def service_discover(request):
 def get_collector_list(request, site_id: int, module_id: int):
     """获取列表"""
 
-    collectors = Collector.objects.filter(module_id=module_id, module__site_id=site_id)
+    collectors = Collector.objects.filter(
+        module_id=module_id, module__site_id=site_id
+    ).select_related("module", "node")
     outlist: list[CollectorOut] = []
 
     for c in collectors:
         out = CollectorOut.from_orm(c)
 
         # 获取运行状态
-        process_name = get_proccess_name(c)
-        try:
-            info = rpc.supervisor.getProcessInfo(process_name)
-            out.running = info["statename"] == "RUNNING"
-        except:
-            out.running = False
+        out.running = c.enabled and is_node_alive(c.node)
+        out.node_name = c.node.name if c.node else ""
 
         # 获取运行地址
         if out.running:
-            out.exporter_url = get_exporter_url(process_name)
+            out.exporter_url = get_exporter_url(c)
 
         # 压入列表
         outlist.append(out)
@@ -253,44 +251,16 @@ def change_collector_status(
     collector = get_object_or_404(
         Collector, id=collector_id, module_id=module_id, module__site_id=site_id
     )
-    process_name = get_proccess_name(collector)
-
-    info = rpc.supervisor.getProcessInfo(process_name)
-    running = info["statename"] == "RUNNING"
-    collector_url = ""
-
-    if payload.running and running:
-        # 获取服务地址
-        collector_url = get_exporter_url(process_name)
-
-    if not payload.running and running:
-        # 停止服务
-        result = rpc.supervisor.stopProcessGroup(process_name)
-        if result and result[0]["description"] != "OK":
-            raise Exception("停止服务错误: " + str(result[0]["description"]))
-
-    if payload.running and not running:
-        # 启动服务
-        result = rpc.supervisor.startProcessGroup(process_name, True)
-
-        if result and result[0]["description"] != "OK":
-            raise Exception("启动服务错误: " + str(result[0]["description"]))
 
-        # 获取服务地址
-        for _ in range(0, 3):
-            collector_url = get_exporter_url(process_name)
-
-            if not collector_url:
-                result = rpc.supervisor.getProcessInfo(process_name)
-
-                if result["statename"] == "RUNNING":
-                    time.sleep(1)
-                else:
-                    break
+    # 只修改启用状态，由采集进程加载时生效
+    collector.enabled = payload.running
+    collector.save()
 
     out = CollectorOut.from_orm(collector)
-    out.running = payload.running
-    out.exporter_url = collector_url
+    out.running = collector.enabled and is_node_alive(collector.node)
+    out.node_name = collector.node.name if collector.node else ""
+    if out.running:
+        out.exporter_url = get_exporter_url(collector)
     return out
 
 
@@ -318,10 +288,4 @@ def delete_collector(
     )
     collector.delete()
 
-    try:
-        delete_process_config(collector)
-        supervisor_update()
-    except:
-        pass
-
     return "Ok"
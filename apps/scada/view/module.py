@@ -1,5 +1,6 @@
 from datetime import datetime
 
+from django.core.cache import cache
 from django.db.models import Q
 from django.shortcuts import get_object_or_404
 from ninja import Router
@@ -12,6 +13,7 @@ from apps.scada.schema.module import (
     ModuleOut,
     ModuleUpdateIn,
 )
+from apps.scada.utils.grm.breaker import get_breaker
 from apps.scada.utils.grm.client import GrmError
 from apps.scada.utils.pool import get_grm_client
 from apps.sys.utils import AuthBearer
@@ -85,6 +87,7 @@ def get_module_info(request, site_id: int, module_id: int):
     except Exception:
         # 模块信息获取不到
         pass
+    out.breaker = get_breaker(module.module_number, cache).state
     return out
 
 
@@ -15,6 +15,7 @@ from apps.scada.schema.site import (
     SiteStatisticValueOut,
 )
 from apps.scada.utils.promql import promql_query
+from apps.scada.view.collector import get_query_ttl
 from apps.sys.utils import AuthBearer, get_enforcer
 from apps.sys.models import User
 from utils.schema.base import api_schema
@@ -317,7 +318,7 @@ def get_statistic_value(
     values = []
     timestamp = 0
 
-    for v in statistic.variables.all():
+    for v in statistic.variables.select_related("module__collector"):
         output.variable_ids.append(v.id)
 
         # 查询字符串
@@ -325,7 +326,7 @@ def get_statistic_value(
         query_str += '{name="' + v.name + '"}'
 
         try:
-            query_data = promql_query(query_str)
+            query_data = promql_query(query_str, ttl=get_query_ttl(v.module))
         except Exception:
             continue
 
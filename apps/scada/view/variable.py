@@ -1,3 +1,6 @@
+import bisect
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import requests
 from django.conf import settings
@@ -7,27 +10,42 @@ from ninja import Query, Router
 from ninja.errors import HttpError
 from prometheus_client import (
     CollectorRegistry,
-    Gauge,
     delete_from_gateway,
     push_to_gateway,
 )
+from prometheus_client.core import GaugeMetricFamily
 
-from apps.scada.models import Module, Variable
+from apps.scada.models import Collector, Module, Variable
 from apps.scada.schema.variable import (
+    ReadRangeIn,
     ReadValueIn,
     VariableIn,
     VariableOptionOut,
     VariableOut,
     ReadValueOut,
+    VariableEmissionIn,
     VariableUpdateIn,
     WriteValueIn,
     WriteValueOut,
 )
+from apps.scada.utils.downsample import (
+    DOWNSAMPLE_METHODS,
+    choose_step,
+    downsample_series,
+    to_arrays,
+)
 from apps.scada.utils.grm.schemas import GrmVariable
+from apps.scada.view.collector import (
+    get_heartbeat_deadline,
+    get_query_ttl,
+    read_collector_values,
+    read_node_values,
+)
 from apps.scada.utils.pool import get_grm_client
 from apps.scada.utils.promql import (
     PrometheusQueryError,
     promql_query,
+    promql_regex_escape,
     promql_query_range,
 )
 from apps.sys.utils import AuthBearer
@@ -36,6 +54,153 @@ from utils.schema.paginate import api_paginate
 
 router = Router()
 
+# 批量写入时不同模块和本地变量并行写
+write_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="var_write")
+
+# 批量范围查询时不同模块并行查询
+query_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="var_query")
+
+# pushgateway复用连接
+pushgateway_session = requests.Session()
+
+
+def pushgateway_handler(url, method, timeout, headers, data):
+    """push_to_gateway的请求实现，使用共享的Session"""
+
+    def handle():
+        resp = pushgateway_session.request(
+            method, url, data=data, headers=dict(headers), timeout=timeout
+        )
+        resp.raise_for_status()
+
+    return handle
+
+
+def get_module_collector(module_id: int) -> Collector:
+    """获取模块启用并且在线的采集器"""
+
+    return (
+        Collector.objects.filter(
+            module_id=module_id,
+            enabled=True,
+            node__heartbeat_at__gte=get_heartbeat_deadline(),
+        )
+        .select_related("module", "node")
+        .first()
+    )
+
+
+def read_recent_values(
+    collector: Collector, vars: list[Variable], seconds=0
+) -> dict[str, list[list[float]]]:
+    """从采集进程内存读取模块变量最近的值
+
+    本地变量不经过采集器，采集器不可用时返回空，由调用方查询Prometheus；
+    读取最近seconds秒时，采集器内存没有覆盖整个时间范围（刚启动或者模块刚迁移过来）
+    也返回空，避免返回不完整的曲线
+    """
+
+    names = [v.name for v in vars if not v.local]
+    if collector is None or not names:
+        return {}
+
+    try:
+        data = read_collector_values(collector, names, seconds)
+    except requests.RequestException:
+        return {}
+    if seconds and not 0 < data["since"] <= time.time() - seconds:
+        return {}
+    return data["values"]
+
+
+def read_modules_recent_values(
+    collectors: dict[int, Collector],
+    grouped_vars: dict[int, list[Variable]],
+    seconds=0,
+) -> dict[tuple[str, str], list[list[float]]]:
+    """从采集进程内存读取多个模块变量最近的值
+
+    同一个采集进程上的模块合并成一个请求，不同采集进程并行请求，
+    返回 (模块编号, 变量名) -> 值列表；采集进程不可用或者内存没有覆盖
+    整个时间范围的模块不返回，由调用方查询Prometheus
+    """
+
+    # 采集进程 -> (节点, 模块编号 -> 变量名)
+    nodes: dict[int, tuple] = {}
+    for module_id, module_vars in grouped_vars.items():
+        collector = collectors.get(module_id)
+        names = [v.name for v in module_vars if not v.local]
+        if collector is None or not names:
+            continue
+        entry = nodes.setdefault(collector.node_id, (collector.node, {}))
+        entry[1][collector.module.module_number] = names
+
+    futures = [
+        query_executor.submit(read_node_values, node, modules, seconds)
+        for node, modules in nodes.values()
+    ]
+
+    values: dict[tuple[str, str], list[list[float]]] = {}
+    deadline = time.time() - seconds
+    for future in futures:
+        try:
+            result = future.result()
+        except requests.RequestException:
+            continue
+        for number, data in result.items():
+            if seconds and not 0 < data["since"] <= deadline:
+                continue
+            for name, recent in data["values"].items():
+                values[(number, name)] = recent
+    return values
+
+
+def parse_duration(duration: str) -> int:
+    """时长字符串转换为秒数，例如 15m、1h、7d"""
+
+    units = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+    return int(timedelta(**{units[duration[-1]]: int(duration[:-1])}).total_seconds())
+
+
+def align_recent_values(
+    recent: list[list[float]], start: int, end: int, step: int
+) -> list[list[float]]:
+    """采集器内存的值对齐到 start + k*step 的时间点，时间点不超过end
+
+    和Prometheus范围查询一样，每个时间点取不晚于它的最后一个值（向前填充）
+    """
+
+    times = [r[0] for r in recent]
+    points: list[list[float]] = []
+    for point in range(start, end + 1, step):
+        i = bisect.bisect_right(times, point)
+        if i:
+            points.append([point, recent[i - 1][1]])
+    return points
+
+
+def get_range_step(duration: int, step: int, max_points: int, method: str) -> int:
+    """指定max_points时根据降采样方法放大查询间隔"""
+
+    if not max_points:
+        return step
+    if max_points < 3:
+        raise HttpError(400, "max_points不能小于3")
+    if method not in DOWNSAMPLE_METHODS:
+        raise HttpError(400, f"downsample只支持{'/'.join(DOWNSAMPLE_METHODS)}")
+    return choose_step(duration, step, max_points, method)
+
+
+def build_range_values(
+    values: list, max_points: int = None, method="lttb"
+) -> list[ReadValueOut.Value]:
+    """[[时间戳, 值], ...] 转换为输出，超过max_points时降采样"""
+
+    if max_points and len(values) > max_points:
+        t, v = downsample_series(*to_arrays(values), max_points, method)
+        values = zip(t.tolist(), v.tolist())
+    return [ReadValueOut.Value(timestamp=t, value=float(v)) for t, v in values]
+
 
 @router.get(
     "/{site_id}/variable/{variable_id}/range",
@@ -55,21 +220,42 @@ def read_range(
     offset: int = None,
     duration: str = "1h",
     step: int = 15,
+    max_points: int = None,
+    downsample: str = "lttb",
 ):
     var = get_object_or_404(Variable, id=variable_id, module__site_id=site_id)
     query_str = "grm_" + var.module.module_number + "_gauge"
     query_str += '{name="' + var.name + '"}'
 
     # 处理 duration 参数
-    units = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
-    duration_seconds = int(
-        timedelta(**{units[duration[-1]]: int(duration[:-1])}).total_seconds()
-    )
+    duration_seconds = parse_duration(duration)
+
+    # 限制点数时放大查询间隔
+    step = get_range_step(duration_seconds, step, max_points, downsample)
+
+    # 最近的数据直接从采集器内存读取，和Prometheus一样对齐到每个step
+    recent = None
+    if offset is None and duration_seconds <= settings.COLLECTOR_RING_SECONDS:
+        recent = read_recent_values(
+            # 多取1秒，时间点取整后窗口开始前的值也在结果里
+            get_module_collector(var.module_id),
+            [var],
+            duration_seconds + 1,
+        ).get(var.name)
 
     # 处理 offset 参数
     if offset is None:
         offset = int(datetime.now().timestamp())
 
+    if recent:
+        out = ReadValueOut.from_orm(var)
+        out.values = build_range_values(
+            align_recent_values(recent, offset - duration_seconds, offset, step),
+            max_points,
+            downsample,
+        )
+        return out
+
     try:
         result = promql_query_range(query_str, offset - duration_seconds, offset, step)
     except PrometheusQueryError as e:
@@ -78,18 +264,15 @@ def read_range(
         raise HttpError(500, f"Request Error: {e}")
 
     # 格式参考 https://prometheus.io/docs/prometheus/latest/querying/api/#range-vectors
-    values: list[ReadValueOut.Value] = []
     out = ReadValueOut.from_orm(var)
     for ret in result:
-        for v in ret["values"]:
-            values.append(ReadValueOut.Value(timestamp=v[0], value=float(v[1])))
+        out.values = build_range_values(ret["values"], max_points, downsample)
         break
-    out.values = values
     return out
 
 
 @router.post(
-    "/{site_id}/variable/values",
+    "/{site_id}/variable/ranges",
     response=list[ReadValueOut],
     auth=AuthBearer(
         [
@@ -99,50 +282,192 @@ def read_range(
     ),
 )
 @api_schema
-def read_values(
+def read_ranges(
     request,
     site_id: int,
-    payload: ReadValueIn,
+    payload: ReadRangeIn,
 ):
-    """批量读取变量值"""
-    vars = Variable.objects.filter(id__in=payload.variable_ids, module__site_id=site_id)
+    """批量读取变量的历史值
 
-    # 获取给定 variable_ids 下每个 module_id 中的变量列表
-    grouped_vars = (
-        vars.select_related("module")
-        .values("module_id", "module__module_number")
-        .distinct()
+    所有变量使用同一组时间点 offset - duration + k*step，
+    同一个模块的变量合并成一个范围查询，不同模块的查询并行执行
+    """
+
+    vars = list(
+        Variable.objects.filter(
+            id__in=payload.variable_ids, module__site_id=site_id
+        ).select_related("module")
+    )
+    duration_seconds = parse_duration(payload.duration)
+    step = get_range_step(
+        duration_seconds, payload.step, payload.max_points, payload.downsample
     )
+    end = payload.offset
+    if end is None:
+        end = int(datetime.now().timestamp())
+    start = end - duration_seconds
+
+    grouped_vars: dict[int, list[Variable]] = {}
+    for v in vars:
+        grouped_vars.setdefault(v.module_id, []).append(v)
+
+    # (模块编号, 变量名) -> 值列表
+    series: dict[tuple[str, str], list[ReadValueOut.Value]] = {}
+
+    # 最近的数据直接从采集器内存读取
+    if payload.offset is None and duration_seconds <= settings.COLLECTOR_RING_SECONDS:
+        collectors = {
+            c.module_id: c
+            for c in Collector.objects.filter(
+                module_id__in=grouped_vars.keys(),
+                enabled=True,
+                node__heartbeat_at__gte=get_heartbeat_deadline(),
+            ).select_related("module", "node")
+        }
+        for key, recent in read_modules_recent_values(
+            collectors, grouped_vars, duration_seconds + 1
+        ).items():
+            series[key] = build_range_values(
+                align_recent_values(recent, start, end, step),
+                payload.max_points,
+                payload.downsample,
+            )
+
+    # 其余变量每个模块一个范围查询
+    queries: dict[str, str] = {}
+    for module_id, module_vars in grouped_vars.items():
+        number = module_vars[0].module.module_number
+        missing = [v.name for v in module_vars if (number, v.name) not in series]
+        if missing:
+            queries[number] = (
+                "grm_"
+                + number
+                + '_gauge{name=~"'
+                + "|".join(promql_regex_escape(name) for name in missing)
+                + '"}'
+            )
+
+    futures = {
+        number: query_executor.submit(promql_query_range, query_str, start, end, step)
+        for number, query_str in queries.items()
+    }
+    for number, future in futures.items():
+        try:
+            result = future.result()
+        except PrometheusQueryError as e:
+            raise HttpError(500, f"Prometheus Query Error: {e}")
+        except requests.RequestException as e:
+            raise HttpError(500, f"Request Error: {e}")
+
+        for ret in result:
+            key = (number, ret["metric"]["name"])
+            if key not in series:
+                series[key] = build_range_values(
+                    ret["values"], payload.max_points, payload.downsample
+                )
 
     outlist: list[ReadValueOut] = []
+    for v in vars:
+        out = ReadValueOut.from_orm(v)
+        out.values = series.get((v.module.module_number, v.name), [])
+        outlist.append(out)
+
+    return outlist
 
-    # 数据是按模块存储，所以变量按模块获取
-    for entry in grouped_vars:
-        module_id = entry["module_id"]
-        module_number = entry["module__module_number"]
-        module_vars = vars.filter(module_id=module_id)
 
-        query_str = "grm_" + module_number + "_gauge"
-        query_str += '{name=~"' + "|".join([v.name for v in module_vars]) + '"}'
+@router.post(
+    "/{site_id}/variable/values",
+    response=list[ReadValueOut],
+    auth=AuthBearer(
+        [
+            ("scada:variable:read", "x"),
+            ("scada:site:permit:{site_id}", "r"),
+        ]
+    ),
+)
+@api_schema
+def read_values(
+    request,
+    site_id: int,
+    payload: ReadValueIn,
+):
+    """批量读取变量值"""
+    vars = list(
+        Variable.objects.filter(
+            id__in=payload.variable_ids, module__site_id=site_id
+        ).select_related("module__collector")
+    )
 
+    # 数据是按模块存储，所以变量按模块分组
+    grouped_vars: dict[int, list[Variable]] = {}
+    for v in vars:
+        grouped_vars.setdefault(v.module_id, []).append(v)
+
+    collectors = {
+        c.module_id: c
+        for c in Collector.objects.filter(
+            module_id__in=grouped_vars.keys(),
+            enabled=True,
+            node__heartbeat_at__gte=get_heartbeat_deadline(),
+        ).select_related("module", "node")
+    }
+
+    # (模块编号, 变量名) -> (时间戳, 值)
+    values: dict[tuple[str, str], tuple[float, float]] = {}
+    # 指标名 -> 模块编号
+    metrics: dict[str, str] = {}
+    selectors: list[str] = []
+    ttl = 0
+
+    # 优先读取采集器内存中的最新值
+    for key, recent in read_modules_recent_values(collectors, grouped_vars).items():
+        values[key] = tuple(recent[-1])
+
+    for module_id, module_vars in grouped_vars.items():
+        module = module_vars[0].module
+
+        # 本地变量和采集器没有的变量查询Prometheus
+        missing = [
+            v.name for v in module_vars if (module.module_number, v.name) not in values
+        ]
+        if missing:
+            metric = "grm_" + module.module_number + "_gauge"
+            metrics[metric] = module.module_number
+            selectors.append(
+                metric
+                + '{name=~"'
+                + "|".join(promql_regex_escape(name) for name in missing)
+                + '"}'
+            )
+            module_ttl = get_query_ttl(module)
+            ttl = module_ttl if not ttl else min(ttl, module_ttl)
+
+    # 所有模块合并成一个查询
+    if selectors:
         try:
-            query_data = promql_query(query_str)
+            query_data = promql_query(" or ".join(selectors), ttl=ttl)
         except PrometheusQueryError as e:
             raise HttpError(500, f"Prometheus Query Error: {e}")
         except requests.RequestException as e:
             raise HttpError(500, f"Request Error: {e}")
 
-        # 构建输出结构
-        for v in vars:
-            out = ReadValueOut.from_orm(v)
-            for result in query_data["data"]["result"]:
-                if result["metric"]["name"] == v.name:
-                    value = ReadValueOut.Value(
-                        timestamp=result["value"][0], value=float(result["value"][1])
-                    )
-                    out.values.append(value)
-                    break
-            outlist.append(out)
+        for result in query_data["data"]["result"]:
+            key = (
+                metrics.get(result["metric"]["__name__"]),
+                result["metric"]["name"],
+            )
+            if key not in values:
+                values[key] = (result["value"][0], float(result["value"][1]))
+
+    # 构建输出结构
+    outlist: list[ReadValueOut] = []
+    for v in vars:
+        out = ReadValueOut.from_orm(v)
+        value = values.get((v.module.module_number, v.name))
+        if value:
+            timestamp, value = value
+            out.values.append(ReadValueOut.Value(timestamp=timestamp, value=value))
+        outlist.append(out)
 
     return outlist
 
@@ -227,6 +552,31 @@ def get_variable_group_list(
     return gs.values("group").distinct().values_list("group", flat=True)
 
 
+@router.put(
+    "/{site_id}/module/{module_id}/variable/groups/{group}/emission",
+    response=int,
+    auth=AuthBearer(
+        [
+            ("scada:variable:edit", "x"),
+            ("scada:site:permit:{site_id}", "w"),
+        ]
+    ),
+)
+@api_schema
+def update_group_emission(
+    request,
+    site_id: int,
+    module_id: int,
+    group: str,
+    payload: VariableEmissionIn,
+):
+    """批量设置变量组的推送配置，返回修改的变量数量"""
+
+    return Variable.objects.filter(
+        module_id=module_id, module__site_id=site_id, group=group
+    ).update(change_only=payload.change_only, deadband=payload.deadband)
+
+
 @router.put(
     "/{site_id}/module/{module_id}/variable/{variable_id}",
     response=VariableOut,
@@ -253,26 +603,42 @@ def update_variable(
     v.type = payload.type
     v.rw = payload.rw
     v.details = payload.details
+    # 推送配置可能是按变量组设置的，没有传入时保留
+    if payload.change_only is not None:
+        v.change_only = payload.change_only
+    if payload.deadband is not None:
+        v.deadband = payload.deadband
     v.save()
     v.site_id = site_id
     return v
 
 
+class LocalVariableCollector(object):
+    """本地变量推送的指标
+
+    不使用Gauge，API在Prometheus多进程模式下运行时Gauge的值会写入共享的指标文件，
+    被 /-/metrics 导出
+    """
+
+    def __init__(self, variable: Variable, value: float):
+        self._variable = variable
+        self._value = value
+
+    def collect(self):
+        gauge = GaugeMetricFamily(
+            f"grm_{self._variable.module.module_number}_gauge",
+            self._variable.details,
+        )
+        gauge.add_metric([], self._value)
+        yield gauge
+
+
 def write_local_var(variable: Variable, payload: WriteValueIn):
     """通过pushgateway实现模块手动设置的本地的变量"""
 
-    # 创建一个 CollectorRegistry 对象
+    # 创建一个 CollectorRegistry 对象，只包含这个变量的值
     registry = CollectorRegistry()
-
-    # 创建一个 Gauge 指标
-    gauge = Gauge(
-        f"grm_{variable.module.module_number}_gauge",
-        variable.details,
-        registry=registry,
-    )
-
-    # 设置指标的值
-    gauge.set(payload.value)
+    registry.register(LocalVariableCollector(variable, payload.value))
 
     # 设置标签
     labels = {"name": variable.name, "type": variable.type, "local": "true"}
@@ -283,9 +649,47 @@ def write_local_var(variable: Variable, payload: WriteValueIn):
         job="grm_local",
         registry=registry,
         grouping_key=labels,
+        handler=pushgateway_handler,
     )
 
 
+def write_module_vars(module: Module, items: list[tuple[Variable, WriteValueIn]]):
+    """一次W请求写入同一个模块的多个变量，返回每个变量的错误码"""
+
+    grm_write_list = [
+        GrmVariable(
+            module_number=module.module_number,
+            type=var.type,
+            name=var.name,
+            value=p.value,
+            group=var.group,
+        )
+        for var, p in items
+    ]
+    try:
+        # 获取客户端
+        client = get_grm_client(module)
+        # 写远程GRM设备
+        client.write(grm_write_list)
+        return [v.write_error for v in grm_write_list]
+    except:
+        return [503] * len(items)
+
+
+def write_local_vars(items: list[tuple[Variable, WriteValueIn]]):
+    """写本地变量，返回每个变量的错误码"""
+
+    def _write(item):
+        try:
+            write_local_var(*item)
+            return 0
+        except Exception:
+            return 503
+
+    # 每个本地变量是pushgateway里单独的分组，分组之间并行推送
+    return list(write_executor.map(_write, items))
+
+
 @router.put(
     "/{site_id}/variable/values",
     response=list[WriteValueOut],
@@ -302,49 +706,53 @@ def update_variable_values(
     site_id: int,
     payload: list[WriteValueIn],
 ):
-    """写模块变量接口"""
-
-    outlist: list[WriteValueOut] = []
+    """写模块变量接口
 
-    # 逐个写入
-    for p in payload:
-        out = WriteValueOut(id=p.id)
-        var = Variable.objects.filter(
-            id=p.id,
-            module__site_id=site_id,
-        ).first()
+    变量一次查询，同一个模块的变量合并成一次W请求，不同模块并行写入
+    """
 
+    outlist = [WriteValueOut(id=p.id) for p in payload]
+    vars = Variable.objects.filter(
+        id__in=[p.id for p in payload], module__site_id=site_id
+    ).select_related("module")
+    var_map = {v.id: v for v in vars}
+
+    # 按模块分组，本地变量单独一组，记录在输出中的位置
+    modules: dict[int, list[int]] = {}
+    local_positions: list[int] = []
+    for i, p in enumerate(payload):
+        var = var_map.get(p.id)
         if not var:
-            out.error = 404
+            outlist[i].error = 404
         elif not var.rw:
-            out.error = 422
+            outlist[i].error = 422
         elif not var.local:
-            # 获取客户端
-            client = get_grm_client(var.module)
-
-            grm_write_list = [
-                GrmVariable(
-                    module_number=var.module.module_number,
-                    type=var.type,
-                    name=var.name,
-                    value=p.value,
-                    group=var.group,
-                )
-            ]
-            try:
-                # 写远程GRM设备
-                client.write(grm_write_list)
-                out.error = grm_write_list[0].write_error
-            except:
-                out.error = 503
+            modules.setdefault(var.module_id, []).append(i)
         else:
-            # 本地pushgateway变量
-            try:
-                write_local_var(var, p)
-            except Exception as e:
-                out.error = 503
+            local_positions.append(i)
+
+    futures = [
+        (
+            positions,
+            write_executor.submit(
+                write_module_vars,
+                var_map[payload[positions[0]].id].module,
+                [(var_map[payload[i].id], payload[i]) for i in positions],
+            ),
+        )
+        for positions in modules.values()
+    ]
+    if local_positions:
+        # 本地pushgateway变量
+        errors = write_local_vars(
+            [(var_map[payload[i].id], payload[i]) for i in local_positions]
+        )
+        for i, error in zip(local_positions, errors):
+            outlist[i].error = error
 
-        outlist.append(out)
+    for positions, future in futures:
+        for i, error in zip(positions, future.result()):
+            outlist[i].error = error
 
     return outlist
 
@@ -432,6 +840,7 @@ def delete_variable(request, site_id: int, module_id: int, variable_id: int):
             settings.PUSHGATEWAY_URL,
             job="grm_local",
             grouping_key=labels,
+            handler=pushgateway_handler,
         )
 
     var.delete()
@@ -97,17 +97,38 @@ PAGINATION_PER_PAGE = 20
 # Prometheus接口配置
 PROMETHEUS_URL = env("PROMETHEUS_URL")
 
+# Prometheus查询超时（秒）
+PROMETHEUS_TIMEOUT = env.int("PROMETHEUS_TIMEOUT", default=5)
+
+# Prometheus连接超时（秒）
+PROMETHEUS_CONNECT_TIMEOUT = env.int("PROMETHEUS_CONNECT_TIMEOUT", default=3)
+
+# Prometheus每个线程的连接池大小
+PROMETHEUS_POOL_SIZE = env.int("PROMETHEUS_POOL_SIZE", default=4)
+
+# 查询语句超过这个长度时使用POST
+PROMETHEUS_POST_THRESHOLD = env.int("PROMETHEUS_POST_THRESHOLD", default=2048)
+
+# 没有采集器的模块（本地变量）即时查询结果缓存时间（秒），0为不缓存
+PROMETHEUS_CACHE_TTL = env.int("PROMETHEUS_CACHE_TTL", default=5)
+
 # 推送地址
 PUSHGATEWAY_URL = env("PUSHGATEWAY_URL")
 
 # Prometheus发现目录
 PROMETHEUS_RULES_DIR = env("PROMETHEUS_RULES_DIR")
 
-# supervisor接口地址
-SUPERVISOR_XMLRPC_URL = env("SUPERVISOR_XMLRPC_URL")
+# GRM模块HTTP连接池大小
+GRM_HTTP_POOL_SIZE = env.int("GRM_HTTP_POOL_SIZE", default=10)
+
+# GRM模块请求重试次数
+GRM_HTTP_RETRIES = env.int("GRM_HTTP_RETRIES", default=1)
 
-# Exporter命令
-SUPERVISOR_COLLECTOR_COMMAND = env("SUPERVISOR_COLLECTOR_COMMAND")
+# GRM模块连接超时（秒）
+GRM_HTTP_CONNECT_TIMEOUT = env.int("GRM_HTTP_CONNECT_TIMEOUT", default=3)
+
+# GRM模块请求超时（秒）
+GRM_HTTP_TIMEOUT = env.int("GRM_HTTP_TIMEOUT", default=5)
 
 # Exporter起始端口
 SUPERVISOR_COLLECTOR_PORT = 20000
@@ -118,8 +139,22 @@ SUPERVISOR_COLLECTOR_HOST = "0.0.0.0"
 # Exporter访问地址
 SUPERVISOR_COLLECTOR_ADVERTISE = env("SUPERVISOR_COLLECTOR_ADVERTISE")
 
-# supervisor任务配置目录
-SUPERVISOR_COLLECTOR_DIR =  env("SUPERVISOR_COLLECTOR_DIR")
+# 旧版本每个模块一个supervisor配置文件的目录，remove_legacy_collectors清理用
+SUPERVISOR_COLLECTOR_DIR = env(
+    "SUPERVISOR_COLLECTOR_DIR", default="/etc/supervisor/include"
+)
+
+# supervisor接口地址，清理旧的采集进程时使用
+SUPERVISOR_XMLRPC_URL = env("SUPERVISOR_XMLRPC_URL", default="")
+
+# 采集进程心跳超时（秒），超时后不再出现在服务发现中
+COLLECTOR_HEARTBEAT_TTL = env.int("COLLECTOR_HEARTBEAT_TTL", default=90)
+
+# 采集器remote-write推送地址，为空时只提供/metrics拉取
+COLLECTOR_REMOTE_WRITE_URL = env("COLLECTOR_REMOTE_WRITE_URL", default="")
+
+# 采集器内存中保留最近多少秒的变量值，API读取这个时间范围内的数据不经过Prometheus
+COLLECTOR_RING_SECONDS = env.int("COLLECTOR_RING_SECONDS", default=300)
 
 YS_APPKEY = env("YS_APPKEY")
 
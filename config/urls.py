@@ -5,6 +5,7 @@ The `urlpatterns` list routes URLs to views. For more information please see:
     https://docs.djangoproject.com/en/4.2/topics/http/urls/
 """
 import json
+import os
 from django.urls import path
 from ninja import NinjaAPI
 from django.http import HttpResponse
@@ -12,6 +13,13 @@ from apps.scada.view import router as scada_router
 from apps.sys.view import router as sys_router
 from utils.schema.errors import set_default_exc_handlers
 from ninja.renderers import JSONRenderer
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    generate_latest,
+    multiprocess,
+)
 
 
 class UTF8JSONRenderer(JSONRenderer):
@@ -29,7 +37,17 @@ def healthy(request):
     return HttpResponse("Ok")
 
 
+def metrics(request):
+    # gunicorn多个worker时汇总所有worker的指标，runserver时只有一个进程
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
 urlpatterns = [
     path("api/", api.urls),
     path("-/healthy", healthy, name="healthy"),
+    path("-/metrics", metrics, name="metrics"),
 ]
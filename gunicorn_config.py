@@ -1,2 +1,22 @@
+import os
+import shutil
+
 workers = 2  # Gunicorn worker 的数量，可以根据需要调整
 bind = '0.0.0.0:8000'  # 绑定的 IP 和端口
+
+# Prometheus多进程模式，每个worker的指标写到这个目录，/-/metrics汇总所有worker
+_multiproc_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", "/tmp/hetu_prometheus"
+)
+
+
+def on_starting(server):
+    # 清理上次运行留下的指标文件
+    shutil.rmtree(_multiproc_dir, ignore_errors=True)
+    os.makedirs(_multiproc_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)